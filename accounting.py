@@ -0,0 +1,129 @@
+from datamodel import *
+from marketdata import MarketData
+import numpy as np
+import pandas as pd
+
+
+class Accounting:
+    # Position, cash and mark to market PnL of one trader, kept in
+    # preallocated (ticks x symbols) arrays per market chunk.
+    # Fills go into the running position and cash dicts, record copies
+    # them into the row of a tick and finish marks the chunk at mid.
+    # The summary is kept as running totals, so memory does not grow with
+    # the number of chunks. The per tick frame is only kept with history.
+    def __init__(self, history=False) -> None:
+        self.history = history
+        self.position: dict[Symbol, Position] = {}
+        self.cash: dict[Symbol, float] = {}
+        # last mid per symbol, carried over ticks and chunks with no book
+        self.marks: dict[Symbol, float] = {}
+        self.market: MarketData = None
+        self.positions = np.zeros((0, 0), dtype=np.int64)
+        self.cash_rows = np.zeros((0, 0))
+        # timestamps, symbols, positions, cash and marks of finished chunks
+        self.chunks: list[tuple[np.ndarray, list[Symbol], np.ndarray, np.ndarray, np.ndarray]] = []
+        # running totals over every tick for summary
+        self.ticks = 0
+        self.last_pnl = 0.0
+        self.peak_pnl = -np.inf
+        self.max_drawdown = 0.0
+        self.exposure_sum = 0.0
+        self.max_exposure = 0.0
+        self.ticks_in_market = 0
+        self.change_sum = 0.0
+        self.change_squares = 0.0
+
+    def start(self, market: MarketData) -> None:
+        shape = (len(market), len(market.symbols))
+        self.market = market
+        self.positions = np.zeros(shape, dtype=np.int64)
+        self.cash_rows = np.zeros(shape)
+
+    def fill(self, symbol: Symbol, price: int, quantity: int) -> None:
+        self.position[symbol] = self.position.get(symbol, 0) + quantity
+        self.cash[symbol] = self.cash.get(symbol, 0.0) - price * quantity
+
+    def record(self, i: int) -> None:
+        symbols = self.market.symbols
+        self.positions[i] = [self.position.get(symbol, 0) for symbol in symbols]
+        self.cash_rows[i] = [self.cash.get(symbol, 0.0) for symbol in symbols]
+
+    def mark_prices(self, market: MarketData) -> np.ndarray:
+        # mid of the best bid and ask, ticks without both sides keep
+        # the previous mid of the symbol
+        bids, asks = market.bid_prices[:, :, 0], market.ask_prices[:, :, 0]
+        book = (bids > 0) & (asks > 0)
+        mids = np.where(book, (bids + asks) / 2, np.nan)
+        first = np.array([self.marks.get(symbol, np.nan) for symbol in market.symbols])
+        marks = pd.DataFrame(np.vstack([first, mids])).ffill().to_numpy()[1:]
+        self.marks.update({symbol: float(marks[-1, s]) for s, symbol in enumerate(market.symbols)
+                           if len(marks) and not np.isnan(marks[-1, s])})
+        return np.nan_to_num(marks)
+
+    def finish(self) -> np.ndarray:
+        # mark to market PnL of every tick of the chunk
+        marks = self.mark_prices(self.market)
+        pnl = self.cash_rows + self.positions * marks
+        if self.history:
+            self.chunks.append((self.market.timestamps, self.market.symbols,
+                                self.positions, self.cash_rows, marks))
+        self.add_totals(pnl.sum(axis=1), (np.abs(self.positions) * marks).sum(axis=1))
+        return pnl
+
+    def add_totals(self, pnl: np.ndarray, exposure: np.ndarray) -> None:
+        if len(pnl) == 0:
+            return
+        peaks = np.maximum.accumulate(np.maximum(pnl, self.peak_pnl))
+        changes = np.diff(pnl) if self.ticks == 0 else np.diff(pnl, prepend=self.last_pnl)
+        self.peak_pnl = float(peaks[-1])
+        self.max_drawdown = max(self.max_drawdown, float((peaks - pnl).max()))
+        self.exposure_sum += float(exposure.sum())
+        self.max_exposure = max(self.max_exposure, float(exposure.max()))
+        self.ticks_in_market += int((exposure > 0).sum())
+        self.change_sum += float(changes.sum())
+        self.change_squares += float((changes * changes).sum())
+        self.ticks += len(pnl)
+        self.last_pnl = float(pnl[-1])
+
+    def profits(self) -> dict[Symbol, float]:
+        # latest mark to market PnL per symbol
+        symbols = list(self.cash) + \
+            [symbol for symbol in self.position if symbol not in self.cash]
+        return {symbol: self.cash.get(symbol, 0.0) + self.position.get(symbol, 0) * self.marks.get(symbol, 0.0)
+                for symbol in symbols}
+
+    def frame(self) -> pd.DataFrame:
+        # per tick totals over all symbols: PnL, drawdown from the running
+        # peak, gross exposure at mid and the PnL of every symbol
+        if not self.history:
+            raise ValueError('the per tick frame needs Accounting(history=True)')
+        frames = []
+        for timestamps, symbols, positions, cash, marks in self.chunks:
+            pnl = pd.DataFrame(cash + positions * marks, columns=symbols,
+                               index=pd.Index(timestamps, name='timestamp'))
+            pnl.insert(0, 'exposure', (np.abs(positions) * marks).sum(axis=1))
+            frames.append(pnl)
+        if not frames:
+            return pd.DataFrame(columns=['pnl', 'drawdown', 'exposure'])
+        frame = pd.concat(frames).fillna(0.0)
+        symbols = [c for c in frame.columns if c != 'exposure']
+        frame.insert(0, 'pnl', frame[symbols].sum(axis=1))
+        frame.insert(1, 'drawdown', frame['pnl'] - frame['pnl'].cummax())
+        return frame
+
+    def summary(self) -> dict[str, float]:
+        # what a sweep ranks candidates by
+        if self.ticks == 0:
+            return {'pnl': 0.0, 'max_drawdown': 0.0, 'mean_exposure': 0.0, 'max_exposure': 0.0,
+                    'time_in_market': 0.0, 'pnl_per_tick_std': 0.0}
+        changes = self.ticks - 1
+        variance = (self.change_squares - self.change_sum ** 2 / changes) / \
+            (changes - 1) if changes > 1 else 0.0
+        return {
+            'pnl': self.last_pnl,
+            'max_drawdown': self.max_drawdown,
+            'mean_exposure': self.exposure_sum / self.ticks,
+            'max_exposure': self.max_exposure,
+            'time_in_market': self.ticks_in_market / self.ticks,
+            'pnl_per_tick_std': float(np.sqrt(max(variance, 0.0))),
+        }
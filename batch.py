@@ -0,0 +1,61 @@
+from trader import Trader
+
+from bt import load_market, simulate_alternative, TRAINING_DATA_PREFIX
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from typing import Any
+import pandas as pd
+import glob
+import os
+import re
+
+# One backtest: round, day and the keyword arguments for Trader
+Job = tuple[int, int, dict[str, Any]]
+
+
+def available_days(prefix=TRAINING_DATA_PREFIX) -> list[tuple[int, int]]:
+    days = []
+    for path in glob.glob(f"{prefix}/prices_round_*_day_*.csv"):
+        match = re.search(r"prices_round_(-?\d+)_day_(-?\d+)\.csv$", path)
+        if match and os.path.exists(f"{prefix}/trades_round_{match[1]}_day_{match[2]}_nn.csv"):
+            days.append((int(match[1]), int(match[2])))
+    return sorted(days)
+
+
+def run_job(job: Job) -> dict[str, float]:
+    round, day, config = job
+    # every job gets a fresh Trader and with it a fresh Logger,
+    # the per tick json of the logger is not wanted on the terminal
+    trader = Trader(**config)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        return simulate_alternative(round, day, trader, write_log=False)
+
+
+def config_name(config: dict[str, Any]) -> str:
+    if not config:
+        return 'default'
+    return ', '.join(f'{key}={value}' for key, value in sorted(config.items()))
+
+
+def run_batch(jobs: list[Job], max_workers=None) -> pd.DataFrame:
+    # Runs every job in its own worker process and merges the final
+    # PnL per symbol into one row per job. Every day is parsed into the
+    # binary cache here first, so the workers only ever read it.
+    for round, day in sorted({(round, day) for round, day, _ in jobs}):
+        load_market(round, day)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(run_job, jobs))
+    rows = []
+    for (round, day, config), profits in zip(jobs, results):
+        row = {'round': round, 'day': day, 'config': config_name(config)}
+        row.update(profits)
+        row['total'] = sum(profits.values())
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# Backtests every day in the training directory with the default Trader
+if __name__ == "__main__":
+    jobs = [(round, day, {}) for round, day in available_days()]
+    summary = run_batch(jobs)
+    print(summary.to_string(index=False))
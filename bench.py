@@ -0,0 +1,217 @@
+from trader import Trader
+
+from datamodel import *
+from accounting import Accounting
+from bt import (TIME_DELTA, clear_order_book, create_log_file, data_paths, liquidate_leftovers,
+                process_prices, process_trades, simulate_alternative, simulate_markets)
+from batch import available_days
+from synth import generate
+from marketdata import MarketData
+from contextlib import redirect_stdout
+from typing import Callable
+import numpy as np
+import pandas as pd
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+# Synthetic days as (tick factor, symbol factor) of a training day
+SCALES = {
+    '1x': (1, 1),
+    '10x': (10, 1),
+    '100x': (10, 10),
+}
+# Running the trader is by far the slowest stage, it is only
+# benchmarked end to end on the smaller scales
+E2E_SCALES = ['1x', '10x']
+# clear_order_book and liquidate_leftovers are timed on this many
+# ticks spread over the day and reported per tick
+SAMPLE_TICKS = 1000
+# Default slowdown against the baseline that counts as a regression
+REGRESSION_THRESHOLD = 0.2
+
+
+def best_time(function: Callable, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def scale_frames(df_prices: pd.DataFrame, df_trades: pd.DataFrame, tick_factor: int, symbol_factor: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Repeats a day tick_factor times one after the other and lists
+    # every product symbol_factor times under a new name
+    span = int(df_prices['timestamp'].max()) + TIME_DELTA
+
+    def scale(df: pd.DataFrame, symbol_column: str) -> pd.DataFrame:
+        names = pd.Categorical(df[symbol_column])
+        categories = [f'{name}_{s}' if s > 0 else name
+                      for s in range(symbol_factor) for name in names.categories]
+        copies = tick_factor * symbol_factor
+        copy = np.repeat(np.arange(copies), len(df))
+        columns = {}
+        for column in df.columns:
+            if column == 'timestamp':
+                columns[column] = np.tile(df[column].to_numpy(), copies) + \
+                    copy // symbol_factor * span
+            elif column == symbol_column:
+                codes = np.tile(names.codes, copies) + \
+                    copy % symbol_factor * len(names.categories)
+                columns[column] = pd.Categorical.from_codes(codes, categories)
+            elif df[column].dtype.kind in 'iuf':
+                columns[column] = np.tile(df[column].to_numpy(), copies)
+        scaled = pd.DataFrame(columns)
+        order = np.argsort(scaled['timestamp'].to_numpy(), kind='stable')
+        return scaled.take(order).reset_index(drop=True)
+
+    return scale(df_prices, 'product'), scale(df_trades, 'symbol')
+
+
+def sample_states(market: MarketData) -> list[TradingState]:
+    ticks = np.unique(np.linspace(0, len(market) - 1,
+                      min(SAMPLE_TICKS, len(market))).astype(int))
+    return [market.state(i) for i in ticks.tolist()]
+
+
+def crossing_orders(state: TradingState) -> dict[Symbol, List[Order]]:
+    # takes two levels on both sides of every book
+    orders = {}
+    for symbol, depth in state.order_depths.items():
+        symbol_orders = []
+        if len(depth.sell_orders) > 0:
+            asks = sorted(depth.sell_orders.keys())
+            symbol_orders.append(Order(symbol, asks[min(1, len(asks) - 1)], 30))
+        if len(depth.buy_orders) > 0:
+            bids = sorted(depth.buy_orders.keys(), reverse=True)
+            symbol_orders.append(Order(symbol, bids[min(1, len(bids) - 1)], -30))
+        orders[symbol] = symbol_orders
+    return orders
+
+
+def bench_day(name: str, df_prices: pd.DataFrame, df_trades: pd.DataFrame, day: int, e2e: bool, repeat: int) -> dict[str, float]:
+    # seconds per stage, clear_order_book and liquidate_leftovers per tick
+    results = {}
+    time_limit = sys.maxsize
+    results[f'{name}/process_prices'] = best_time(
+        lambda: process_prices(df_prices, time_limit), repeat)
+    market = process_prices(df_prices, time_limit)
+    results[f'{name}/process_trades'] = best_time(
+        lambda: process_trades(df_trades, market, time_limit), repeat)
+
+    states = sample_states(market)
+    orders = [crossing_orders(state) for state in states]
+
+    def clear_all():
+        for state, state_orders in zip(states, orders):
+            clear_order_book(state_orders, state.order_depths, state.timestamp)
+    results[f'{name}/clear_order_book'] = best_time(
+        clear_all, repeat) / len(states)
+
+    def liquidate_all():
+        for state in states:
+            books = Accounting()
+            books.position = {symbol: 10 if i % 2 else -10 for i,
+                              symbol in enumerate(state.order_depths)}
+            liquidate_leftovers(books, state)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        results[f'{name}/liquidate_leftovers'] = best_time(
+            liquidate_all, repeat) / len(states)
+
+    profits = np.zeros((len(market), len(market.symbols)))
+    trader = Trader()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            results[f'{name}/create_log_file'] = best_time(
+                lambda: create_log_file(market, day, profits, trader), repeat)
+        finally:
+            os.chdir(cwd)
+
+    if e2e:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            results[f'{name}/simulate'] = best_time(
+                lambda: simulate_markets([market], day, Trader(), write_log=False), 1)
+    return results
+
+
+def run_benchmarks(scales: list[str], repeat=3) -> dict[str, float]:
+    results = {}
+    days = available_days()
+    for round, day in days:
+        prices_path, trades_path = data_paths(round, day)
+        df_prices = pd.read_csv(prices_path, sep=';')
+        df_trades = pd.read_csv(trades_path, sep=';')
+        results.update(bench_day(
+            f'round_{round}_day_{day}', df_prices, df_trades, day, False, repeat))
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            results[f'round_{round}_day_{day}/simulate_alternative'] = best_time(
+                lambda: simulate_alternative(round, day, Trader(), write_log=False), 1)
+        print(f'round {round} day {day} done', file=sys.stderr)
+
+    if days:
+        round, day = days[0]
+        prices_path, trades_path = data_paths(round, day)
+        df_prices = pd.read_csv(prices_path, sep=';')
+        df_trades = pd.read_csv(trades_path, sep=';')
+    else:
+        # the synthetic scales are built from a generated day instead
+        print('No prices and trades files in the training directory, using a generated day', file=sys.stderr)
+        day = 0
+        df_prices, df_trades = generate(day)
+    for scale in scales:
+        tick_factor, symbol_factor = SCALES[scale]
+        scaled_prices, scaled_trades = scale_frames(
+            df_prices, df_trades, tick_factor, symbol_factor)
+        results.update(bench_day(f'synthetic_{scale}', scaled_prices, scaled_trades,
+                                 day, scale in E2E_SCALES, repeat))
+        print(f'synthetic {scale} done', file=sys.stderr)
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float) -> pd.DataFrame:
+    table = pd.DataFrame({'baseline': pd.Series(baseline, dtype=float),
+                          'current': pd.Series(results, dtype=float)})
+    table['change'] = table['current'] / table['baseline'] - 1
+    table['regression'] = table['change'] > threshold
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the stages of the backtester')
+    parser.add_argument('--scales', nargs='*', default=list(SCALES),
+                        choices=list(SCALES), help='synthetic day sizes to run')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per stage, the fastest counts')
+    parser.add_argument('--save', help='write the results to this json file')
+    parser.add_argument(
+        '--compare', help='json baseline to compare the results with')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='relative slowdown that fails the comparison')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scales, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'results': results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        table = compare(results, baseline, args.threshold)
+        print(table.to_string(float_format=lambda v: f'{v:.6f}'))
+        regressions = table[table['regression']]
+        if len(regressions) > 0:
+            print(
+                f'{len(regressions)} stages regressed by more than {args.threshold:.0%}')
+            sys.exit(1)
+    else:
+        for key, seconds in results.items():
+            print(f'{key:50} {seconds:.6f}')
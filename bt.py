@@ -1,11 +1,15 @@
 from trader import Trader
 
 from datamodel import *
-from typing import Any
+from accounting import Accounting
+from marketdata import MarketData, load_cached, stream_markets
+from matching import PriceLadder, TradeTape, queue_fill, BUY, SELL
+from typing import Any, Iterable, Iterator, Optional
 import numpy as np
 import pandas as pd
-import statistics
-import copy
+import shutil
+import sys
+import tempfile
 import uuid
 
 # Timesteps used in training files
@@ -25,67 +29,12 @@ SYMBOLS = [
 ]
 
 
-def process_prices(df_prices, time_limit) -> dict[int, TradingState]:
-    states = {}
-    for _, row in df_prices.iterrows():
-        time: int = int(row["timestamp"])
-        if time > time_limit:
-            break
-        product: str = row["product"]
-        if states.get(time) == None:
-            position: Dict[Product, Position] = {}
-            own_trades: Dict[Symbol, List[Trade]] = {}
-            market_trades: Dict[Symbol, List[Trade]] = {}
-            observations: Dict[Product, Observation] = {}
-            listings = {}
-            depths = {}
-            states[time] = TradingState(
-                time, listings, depths, own_trades, market_trades, position, observations)
-
-        if product not in states[time].position:
-            states[time].position[product] = 0
-            states[time].own_trades[product] = []
-            states[time].market_trades[product] = []
-
-        states[time].listings[product] = Listing(product, product, "1")
-
-        if product == "DOLPHIN_SIGHTINGS":
-            states[time].observations["DOLPHIN_SIGHTINGS"] = row['mid_price']
-
-        depth = OrderDepth()
-        if row["bid_price_1"] > 0:
-            depth.buy_orders[row["bid_price_1"]] = int(row["bid_volume_1"])
-        if row["bid_price_2"] > 0:
-            depth.buy_orders[row["bid_price_2"]] = int(row["bid_volume_2"])
-        if row["bid_price_3"] > 0:
-            depth.buy_orders[row["bid_price_3"]] = int(row["bid_volume_3"])
-        if row["ask_price_1"] > 0:
-            depth.sell_orders[row["ask_price_1"]] = int(row["ask_volume_1"])
-        if row["ask_price_2"] > 0:
-            depth.sell_orders[row["ask_price_2"]] = int(row["ask_volume_2"])
-        if row["ask_price_3"] > 0:
-            depth.sell_orders[row["ask_price_3"]] = int(row["ask_volume_3"])
-        states[time].order_depths[product] = depth
-
-    return states
-
-
-def process_trades(df_trades, states: dict[int, TradingState], time_limit):
-    for _, trade in df_trades.iterrows():
-        time: int = trade['timestamp']
-        if time > time_limit:
-            break
-        symbol = trade['symbol']
-        if symbol not in states[time].market_trades:
-            states[time].market_trades[symbol] = []
-        t = Trade(
-            symbol,
-            trade['price'],
-            trade['quantity'],
-            '',  # trade['buyer'],
-            '',  # trade['seller'],
-            time)
-        states[time].market_trades[symbol].append(t)
+def process_prices(df_prices, time_limit) -> MarketData:
+    return MarketData.from_prices(df_prices, time_limit)
+
+
+def process_trades(df_trades, market: MarketData, time_limit):
+    market.add_trades(df_trades, time_limit)
 
 
 current_limits = {
@@ -101,149 +50,370 @@ current_limits = {
 # print_position prints the position before! every Trader.run
 
 
-def simulate_alternative(round: int, day: int, trader, print_position=False, time_limit=999900, end_liquidation=True):
+def with_next(ticks: Iterable[Any]) -> Iterator[tuple[Any, Optional[Any]]]:
+    ticks = iter(ticks)
+    tick = next(ticks, None)
+    while tick is not None:
+        next_tick = next(ticks, None)
+        yield tick, next_tick
+        tick = next_tick
+
+
+def data_paths(round: int, day: int) -> tuple[str, str]:
     prices_path = f"{TRAINING_DATA_PREFIX}/prices_round_{round}_day_{day}.csv"
     trades_path = f"{TRAINING_DATA_PREFIX}/trades_round_{round}_day_{day}_nn.csv"
+    return prices_path, trades_path
+
+
+def load_market(round: int, day: int, time_limit=999900, cache=True) -> MarketData:
+    prices_path, trades_path = data_paths(round, day)
+    if cache:
+        return load_cached(prices_path, trades_path, time_limit)
     df_prices = pd.read_csv(prices_path, sep=';')
     df_trades = pd.read_csv(trades_path, sep=';')
-    states = process_prices(df_prices, time_limit)
-    process_trades(df_trades, states, time_limit)
-    position = copy.copy(states[0].position)
-    ref_symbols = list(states[0].position.keys())
-    profits_by_symbol: dict[int, dict[str, float]] = {
-        0: dict(zip(ref_symbols, [0.0]*len(ref_symbols)))}
-    max_time = max(list(states.keys()))
-    for time, state in states.items():
-        position = copy.deepcopy(state.position)
-        orders = trader.run(state)
-        trades = clear_order_book(orders, state.order_depths, time)
-        if print_position:
-            print(position)
-        if profits_by_symbol.get(time + TIME_DELTA) == None and time != max_time:
-            profits_by_symbol[time +
-                              TIME_DELTA] = copy.deepcopy(profits_by_symbol[time])
-        if len(trades) > 0:
-            grouped_by_symbol = {}
-            for trade in trades:
-                current_pnl = profits_by_symbol[time][trade.symbol]
-                if grouped_by_symbol.get(trade.symbol) == None:
-                    grouped_by_symbol[trade.symbol] = []
-                n_position = position[trade.symbol] + trade.quantity
-                if abs(n_position) > current_limits[trade.symbol]:
-                    print(
-                        'ILLEGAL TRADE, WOULD EXCEED POSITION LIMIT, KILLING ALL REMAINING ORDERS')
-                    trade_vars = vars(trade)
-                    trade_str = ', '.join("%s: %s" %
-                                          item for item in trade_vars.items())
-                    print(f'Stopped at the following trade: {trade_str}')
-                    print(f"All trades that were sent:")
-                    for trade in trades:
-                        trade_vars = vars(trade)
-                        trades_str = ', '.join(
-                            "%s: %s" % item for item in trade_vars.items())
-                        print(trades_str)
-                    break
-                position[trade.symbol] = n_position
-                current_pnl += -trade.price * trade.quantity
-                if states.get(time + TIME_DELTA) != None:
-                    profits_by_symbol[time +
-                                      TIME_DELTA][trade.symbol] = current_pnl
-            if states.get(time + TIME_DELTA) != None:
-                states[time + TIME_DELTA].own_trades = grouped_by_symbol
-        if time == max_time:
-            print("End of simulation reached. All positions left are liquidated")
-            if end_liquidation:
-                liquidate_leftovers(position, profits_by_symbol, state, time)
-        if states.get(time + TIME_DELTA) != None:
-            states[time + TIME_DELTA].position = copy.deepcopy(position)
-    create_log_file(states, day, profits_by_symbol, trader)
-
-
-def liquidate_leftovers(position: dict[Product, Position], profits_by_symbol: dict[int, dict[str, float]], state: TradingState, time: int):
-    liquidated_position = copy.deepcopy(position)
-    for symbol in position.keys():
-        if liquidated_position[symbol] != 0:
-            if liquidated_position[symbol] > 0:
-                sorted_sell_prices = list(
-                    state.order_depths[symbol].sell_orders.keys())
-                sorted_sell_prices.sort(reverse=True)
-                for ask_order_price in sorted_sell_prices:
-                    if abs(liquidated_position[symbol]) <= abs(state.order_depths[symbol].sell_orders[ask_order_price]):
-                        profits_by_symbol[time][symbol] += ask_order_price * \
-                            liquidated_position[symbol]
-                        liquidated_position[symbol] = 0
-                        break
-                    else:
-                        profits_by_symbol[time][symbol] += ask_order_price * \
-                            state.order_depths[symbol].sell_orders[ask_order_price]
-                        liquidated_position[symbol] -= state.order_depths[symbol].sell_orders[ask_order_price]
-                if liquidated_position[symbol] > 0:
-                    print(
-                        f'Unable to liquidate all LONG positions for {symbol}, left with {liquidated_position[symbol]}')
+    market = process_prices(df_prices, time_limit)
+    process_trades(df_trades, market, time_limit)
+    return market
+
+
+def simulate_alternative(round: int, day: int, trader, print_position=False, time_limit=999900, end_liquidation=True, stream=False, write_log=True, profiler=None, accounting=None, liquidation='walk', fill_model='book'):
+    if stream:
+        # the csv files are read chunk by chunk and every chunk is logged
+        # as soon as it is simulated
+        markets = stream_markets(*data_paths(round, day), time_limit)
+    else:
+        markets = [load_market(round, day, time_limit)]
+    return simulate_markets(markets, day, trader, print_position, end_liquidation, stream, write_log, profiler, accounting, liquidation, fill_model)
+
+
+# profiler is an optional profiler.TickProfiler timing every phase of a tick,
+# accounting an optional accounting.Accounting to read the books from afterwards,
+# liquidation one of LIQUIDATION_MODES and fill_model one of FILL_MODELS
+def simulate_markets(markets: Iterable[MarketData], day: int, trader, print_position=False, end_liquidation=True, stream=False, write_log=True, profiler=None, accounting=None, liquidation='walk', fill_model='book'):
+    books = accounting if accounting is not None else Accounting()
+    simulate_traders(markets, day, [trader], print_position, end_liquidation,
+                     stream, write_log, profiler, [books], liquidation, fill_model)
+    return books.profits()
+
+
+def simulate_alternatives(round: int, day: int, traders: list, names: Optional[list[str]] = None, time_limit=999900, end_liquidation=True, stream=False, write_log=False, liquidation='walk', fill_model='book') -> pd.DataFrame:
+    # Runs the traders head to head on one load of the day and returns
+    # their mark to market PnL curves, one column per trader
+    if stream:
+        markets = stream_markets(*data_paths(round, day), time_limit)
+    else:
+        markets = [load_market(round, day, time_limit)]
+    books = simulate_traders(markets, day, traders, end_liquidation=end_liquidation,
+                             accountings=[Accounting(history=True) for _ in traders],
+                             stream=stream, write_log=write_log, liquidation=liquidation,
+                             fill_model=fill_model)
+    return pnl_curves(books, names)
+
+
+def pnl_curves(books: list[Accounting], names: Optional[list[str]] = None) -> pd.DataFrame:
+    names = names if names is not None else [
+        f'trader_{n}' for n in range(len(books))]
+    # the books need to have been kept with Accounting(history=True)
+    return pd.DataFrame({name: accounting.frame()['pnl'] for name, accounting in zip(names, books)})
+
+
+class TraderRun:
+    # What one trader in a simulation owns: its books, the own trades it
+    # gets to see on the next tick and its log
+    def __init__(self, trader, books: Accounting, log: Optional['StreamingLog']):
+        self.trader = trader
+        self.books = books
+        self.log = log
+        self.local_logs = getattr(
+            getattr(trader, 'logger', None), 'local_logs', None)
+        self.own_trades: Optional[dict[Symbol, list[Trade]]] = None
+
+
+def copy_depths(order_depths: dict[Symbol, OrderDepth]) -> dict[Symbol, OrderDepth]:
+    copies = {}
+    for symbol, depth in order_depths.items():
+        copy = OrderDepth()
+        copy.buy_orders = dict(depth.buy_orders)
+        copy.sell_orders = dict(depth.sell_orders)
+        copies[symbol] = copy
+    return copies
+
+
+def copy_trades(market_trades: dict[Symbol, list[Trade]]) -> dict[Symbol, list[Trade]]:
+    return {symbol: list(trades) for symbol, trades in market_trades.items()}
+
+
+def trader_state(market_state: TradingState) -> TradingState:
+    # What one trader is handed: copies of everything in the state of the
+    # tick, so nothing it changes reaches the matching or another trader
+    return TradingState(market_state.timestamp, dict(market_state.listings),
+                        copy_depths(market_state.order_depths),
+                        copy_trades(market_state.own_trades),
+                        copy_trades(market_state.market_trades),
+                        dict(market_state.position), dict(market_state.observations))
+
+
+def simulate_traders(markets: Iterable[MarketData], day: int, traders: list, print_position=False, end_liquidation=True, stream=False, write_log=True, profiler=None, accountings=None, liquidation='walk', fill_model='book') -> list[Accounting]:
+    # Steps every trader through the same ticks in lockstep. Every state
+    # is built once, each trader gets its own copy of it with its own
+    # position and own trades, and the orders are matched against the
+    # untouched depths, so a trader is simulated the same alone or next to
+    # others. Each trader has its own books and log.
+    # States are only built once the simulation reaches their tick and are
+    # dropped right after, the log is written from the columnar market data
+    # and the mark to market PnL of every tick.
+    if liquidation not in LIQUIDATION_MODES:
+        raise ValueError(
+            f'unknown liquidation mode {liquidation}, use one of {LIQUIDATION_MODES}')
+    if fill_model not in FILL_MODELS:
+        raise ValueError(
+            f'unknown fill model {fill_model}, use one of {FILL_MODELS}')
+    if accountings is None:
+        accountings = [Accounting() for _ in traders]
+    runs = [TraderRun(trader, books, StreamingLog(day, trader) if stream and write_log else None)
+            for trader, books in zip(traders, accountings)]
+    ticks = ((market, i, market.state(i))
+             for market in markets for i in range(len(market)))
+    started = False
+    tape = next_tape = None
+    if profiler is not None:
+        restore_traders = [profiler.instrument(trader) for trader in traders]
+        profiler.start()
+    for (market, i, market_state), next_tick in with_next(ticks):
+        if profiler is not None:
+            profiler.mark('state')
+        time = market_state.timestamp
+        has_next = next_tick is not None
+        market_ends = next_tick is None or next_tick[0] is not market
+        # orders resting at the last tick of a chunk meet the trades of the
+        # first tick of the next one, so its tape is built a tick early
+        if fill_model == 'queue':
+            if i == 0:
+                tape = next_tape if next_tape is not None else TradeTape(market)
+                next_tape = None
+            if market_ends and has_next:
+                next_tape = TradeTape(next_tick[0])
+        fill_tape, fill_tick = (tape, i + 1) if next_tape is None else (next_tape, 0)
+        for n, run in enumerate(runs):
+            books = run.books
+            state = trader_state(market_state)
+            if i == 0:
+                books.start(market)
+            if not started:
+                books.position.update(state.position)
+                books.cash.update(dict.fromkeys(state.position, 0.0))
             else:
-                sorted_buy_prices = list(
-                    state.order_depths[symbol].buy_orders.keys())
-                sorted_buy_prices.sort(reverse=True)
-                for buy_order_price in sorted_buy_prices:
-                    if abs(liquidated_position[symbol]) <= abs(state.order_depths[symbol].buy_orders[buy_order_price]):
-                        profits_by_symbol[time][symbol] -= buy_order_price * \
-                            liquidated_position[symbol]
-                        liquidated_position[symbol] = 0
+                state.position = dict(books.position)
+            if run.own_trades is not None:
+                state.own_trades = run.own_trades
+            run.own_trades = None
+            # fills of this tick are booked on the next one,
+            # the last tick has nowhere else to book them
+            if has_next:
+                books.record(i)
+            position = books.position
+            if print_position:
+                print(position)
+            # the trader phase is Trader.run alone, one per trader in lockstep
+            if profiler is not None:
+                profiler.mark('state')
+            orders = run.trader.run(state)
+            if profiler is not None:
+                profiler.mark('trader' if len(runs) == 1 else f'trader_{n}')
+            # resting orders meet the trades printed up to the next tick,
+            # the end of day liquidation walks what they left of the book
+            ladders = {}
+            trades = clear_order_book(
+                orders, market_state.order_depths, time, fill_tape, fill_tick, ladders)
+            if profiler is not None:
+                profiler.mark('matching')
+            if len(trades) > 0:
+                grouped_by_symbol = {}
+                for trade in trades:
+                    if grouped_by_symbol.get(trade.symbol) == None:
+                        grouped_by_symbol[trade.symbol] = []
+                    n_position = position.get(trade.symbol, 0) + trade.quantity
+                    if abs(n_position) > current_limits[trade.symbol]:
+                        print(
+                            'ILLEGAL TRADE, WOULD EXCEED POSITION LIMIT, KILLING ALL REMAINING ORDERS')
+                        trade_vars = attributes(trade)
+                        trade_str = ', '.join("%s: %s" %
+                                              item for item in trade_vars.items())
+                        print(f'Stopped at the following trade: {trade_str}')
+                        print(f"All trades that were sent:")
+                        for trade in trades:
+                            trade_vars = attributes(trade)
+                            trades_str = ', '.join(
+                                "%s: %s" % item for item in trade_vars.items())
+                            print(trades_str)
                         break
-                    else:
-                        profits_by_symbol[time][symbol] -= buy_order_price * \
-                            state.order_depths[symbol].buy_orders[buy_order_price]
-                        liquidated_position[symbol] += state.order_depths[symbol].buy_orders[buy_order_price]
-                if liquidated_position[symbol] < 0:
-                    print(
-                        f'Unable to liquidate all SHORT positions for {symbol}, left with {liquidated_position[symbol]}')
-        position = liquidated_position
-
-
-def cleanup_order_volumes(org_orders: List[Order]) -> List[Order]:
-    orders = []  # copy.deepcopy(org_orders)
-    for order_1 in org_orders:
-        final_order = copy.copy(order_1)
-        for order_2 in org_orders:
-            if order_1.price == order_2.price and order_1.quantity == order_2.quantity:
+                    books.fill(trade.symbol, trade.price, trade.quantity)
+                    grouped_by_symbol[trade.symbol].append(trade)
+                if has_next:
+                    run.own_trades = grouped_by_symbol
+            if not has_next:
+                print("End of simulation reached. All positions left are liquidated")
+                if end_liquidation:
+                    liquidate_leftovers(books, market_state, liquidation, ladders=ladders)
+                books.record(i)
+            if profiler is not None:
+                profiler.mark('pnl')
+            if market_ends:
+                market_profits = books.finish()
+                if run.log is None and write_log and has_next:
+                    # more chunks follow, the log is written one chunk at a time
+                    run.log = StreamingLog(day, run.trader)
+                if run.log is not None:
+                    run.log.write_market(market, market_profits)
+                elif write_log and next_tick is None:
+                    create_log_file(market, day, market_profits, run.trader)
+            if not write_log and run.local_logs is not None:
+                # nothing reads them, so they must not pile up over the run
+                run.local_logs.pop(time, None)
+            if profiler is not None:
+                profiler.mark('logging')
+        started = True
+        if profiler is not None:
+            profiler.end_tick(time)
+    for run in runs:
+        # loggers that batch their output write the rest of it now
+        logger = getattr(run.trader, 'logger', None)
+        if hasattr(logger, 'close'):
+            logger.close()
+        if run.log is not None:
+            run.log.close()
+    if profiler is not None:
+        for restore in reversed(restore_traders):
+            restore()
+    return accountings
+
+
+# How orders are filled: only against the book of their tick, or with
+# what is left resting until the market trades of the next tick
+FILL_MODELS = ['book', 'queue']
+
+
+# Ask and bid ladders of a symbol as matching left them
+Ladders = dict[Symbol, tuple[PriceLadder, PriceLadder]]
+
+
+# How positions left at the end of the simulation are closed: walk the
+# book like an order without a limit, close at the mid, or close at the
+# mid minus LIQUIDATION_SLIPPAGE per unit
+LIQUIDATION_MODES = ['walk', 'mid', 'slippage']
+LIQUIDATION_SLIPPAGE = 1.0
+
+
+def liquidate_leftovers(books: Accounting, state: TradingState, mode='walk', slippage=LIQUIDATION_SLIPPAGE, ladders: Optional[Ladders] = None):
+    # ladders are what the orders of the same tick left of the book,
+    # symbols without them walk the full depth of the state
+    if mode not in LIQUIDATION_MODES:
+        raise ValueError(f'unknown liquidation mode {mode}, use one of {LIQUIDATION_MODES}')
+    for symbol, position in list(books.position.items()):
+        if position == 0:
+            continue
+        depth = state.order_depths.get(symbol)
+        if mode == 'walk':
+            if depth is None:
+                continue
+            # longs are sold into the bids from the best one down,
+            # shorts are bought back from the asks from the best one up
+            if ladders is not None and symbol in ladders:
+                asks, bids = ladders[symbol]
+            else:
+                asks, bids = PriceLadder(depth.sell_orders, BUY), PriceLadder(depth.buy_orders, SELL)
+            if position > 0:
+                for price, volume in bids.take(0, position):
+                    books.fill(symbol, price, -volume)
+            else:
+                for price, volume in asks.take(sys.maxsize, -position):
+                    books.fill(symbol, price, volume)
+        else:
+            if depth is not None and depth.buy_orders and depth.sell_orders:
+                mid = (max(depth.buy_orders) + min(depth.sell_orders)) / 2
+            else:
+                mid = books.marks.get(symbol)
+            if mid is None:
                 continue
-            if order_1.price == order_2.price:
-                final_order.quantity += order_2.quantity
-        orders.append(final_order)
-    return orders
+            price = mid if mode == 'mid' else mid - slippage if position > 0 else mid + slippage
+            books.fill(symbol, price, -position)
+        left = books.position[symbol]
+        if left > 0:
+            print(f'Unable to liquidate all LONG positions for {symbol}, left with {left}')
+        elif left < 0:
+            print(f'Unable to liquidate all SHORT positions for {symbol}, left with {left}')
 
 
-def clear_order_book(trader_orders: dict[str, List[Order]], order_depth: dict[str, OrderDepth], time: int) -> list[Trade]:
+def cleanup_order_volumes(org_orders: List[Order]) -> tuple[List[Order], List[Order]]:
+    # Nets the orders of one symbol per price in a single pass and splits
+    # them by side, buys from the lowest price and sells from the highest.
+    # Walked in this order every order only takes the levels it priced,
+    # one at a cheap ask does not use up the ask a higher bid was meant for.
+    volumes: dict[int, int] = {}
+    for order in org_orders:
+        volumes[order.price] = volumes.get(order.price, 0) + order.quantity
+    if not volumes:
+        return [], []
+    symbol = org_orders[0].symbol
+    prices = sorted(volumes.keys())
+    buy_orders = [Order(symbol, price, volumes[price])
+                  for price in prices if volumes[price] > 0]
+    sell_orders = [Order(symbol, price, volumes[price])
+                   for price in reversed(prices) if volumes[price] < 0]
+    return buy_orders, sell_orders
+
+
+def clear_order_book(trader_orders: dict[str, List[Order]], order_depth: dict[str, OrderDepth], time: int, tape: Optional[TradeTape] = None, tick=0, ladders: Optional[Ladders] = None) -> list[Trade]:
+    # Buy orders walk the asks from the lowest price up to their limit,
+    # sell orders walk the bids down. Fills happen at the book's price and
+    # use up its volume, so later orders of the same tick see what is left.
+    # With a tape what is left of an order rests at its price and is
+    # filled by the market trades of tick behind the book volume queued
+    # there, the best priced resting order first. The ladders of every
+    # matched symbol are put into ladders when it is given.
     trades = []
     for symbol in trader_orders.keys():
         if order_depth.get(symbol) != None:
-            symbol_order_depth = copy.deepcopy(order_depth[symbol])
-            t_orders = cleanup_order_volumes(trader_orders[symbol])
-            for order in t_orders:
-                if order.quantity < 0:
-                    potential_matches = list(
-                        filter(lambda o: o[0] == order.price, symbol_order_depth.buy_orders.items()))
-                    if len(potential_matches) > 0:
-                        match = potential_matches[0]
-                        final_volume = 0
-                        if match[1] > order.quantity:
-                            final_volume = order.quantity
-                        else:
-                            final_volume = match[1]
-                        trades.append(Trade(symbol, order.price,
-                                      final_volume, "YOU", "BOT", time))
-                if order.quantity > 0:
-                    potential_matches = list(
-                        filter(lambda o: o[0] == order.price, symbol_order_depth.sell_orders.items()))
-                    if len(potential_matches) > 0:
-                        match = potential_matches[0]
-                        final_volume = 0
-                        if match[1] > order.quantity:
-                            final_volume = order.quantity
-                        else:
-                            final_volume = match[1]
-                        trades.append(Trade(symbol, order.price,
-                                      final_volume, "YOU", "BOT", time))
+            depth = order_depth[symbol]
+            asks = PriceLadder(depth.sell_orders, BUY)
+            bids = PriceLadder(depth.buy_orders, SELL)
+            if ladders is not None:
+                ladders[symbol] = (asks, bids)
+            buy_orders, sell_orders = cleanup_order_volumes(
+                trader_orders[symbol])
+            resting_buys, resting_sells = [], []
+            for order in buy_orders:
+                left = order.quantity
+                for price, volume in asks.take(order.price, order.quantity):
+                    trades.append(
+                        Trade(symbol, price, volume, "YOU", "BOT", time))
+                    left -= volume
+                if left > 0:
+                    resting_buys.append((order.price, left))
+            for order in sell_orders:
+                left = -order.quantity
+                for price, volume in bids.take(order.price, -order.quantity):
+                    trades.append(
+                        Trade(symbol, price, -volume, "BOT", "YOU", time))
+                    left -= volume
+                if left > 0:
+                    resting_sells.append((order.price, left))
+            if tape is None:
+                continue
+            used = {}
+            for price, left in reversed(resting_buys):
+                volume = queue_fill(tape, tick, symbol, price, left, BUY,
+                                    depth.buy_orders.get(price, 0), used)
+                if volume > 0:
+                    trades.append(
+                        Trade(symbol, price, volume, "YOU", "BOT", time))
+            used = {}
+            for price, left in reversed(resting_sells):
+                volume = queue_fill(tape, tick, symbol, price, left, SELL,
+                                    abs(depth.sell_orders.get(price, 0)), used)
+                if volume > 0:
+                    trades.append(
+                        Trade(symbol, price, -volume, "BOT", "YOU", time))
     return trades
 
 
@@ -257,70 +427,130 @@ log_header = [
 ]
 
 
-def create_log_file(states: dict[int, TradingState], day, profits: dict[int, dict[str, float]], trader: Trader):
+def sandbox_log(timestamps: List[int], trader: Trader, pop=False) -> str:
+    local_logs = {}
+    if hasattr(trader, 'logger') and hasattr(trader.logger, 'local_logs'):
+        local_logs = trader.logger.local_logs
+    lines = []
+    for time in timestamps:
+        if local_logs.get(time) != None:
+            lines.append(f'{time} {local_logs[time]}\n')
+            if pop:
+                del local_logs[time]
+        elif time != 0:
+            lines.append(f'{time}\n')
+    return ''.join(lines)
+
+
+# Ticks of the activities log formatted and written at once
+ACTIVITIES_CHUNK = 2000
+
+
+def format_column(values: np.ndarray, empty=None) -> np.ndarray:
+    # prices, volumes and profits repeat a lot, so only the distinct
+    # values are turned into strings
+    distinct, inverse = np.unique(values, return_inverse=True)
+    column = np.array([str(value)
+                      for value in distinct.tolist()], dtype=object)[inverse]
+    if empty is not None:
+        column[empty] = ''
+    return column
+
+
+def activities_rows(day, market: MarketData, profits: np.ndarray, start=0, end=None) -> list[str]:
+    # One row per tick from start to end and listed symbol, built a column
+    # at a time. Symbols missing from a tick get no row instead of failing.
+    order = [market.symbols.index(symbol) for symbol in SYMBOLS if symbol in market.symbols] + \
+        [s for s, symbol in enumerate(market.symbols) if symbol not in SYMBOLS]
+    present = market.present[start:end, order]
+    ticks, symbols = np.nonzero(present)
+    ticks += start
+    symbols = np.array(order, dtype=np.int64)[symbols]
+
+    bid_prices = market.bid_prices[ticks, symbols]
+    bid_volumes = market.bid_volumes[ticks, symbols]
+    ask_prices = market.ask_prices[ticks, symbols]
+    ask_volumes = market.ask_volumes[ticks, symbols]
+    # mid of the best bid and ask, sides without orders give 0 and
+    # observations show the mid_price they were read with
+    no_book = ~((bid_prices > 0).any(axis=1) & (ask_prices > 0).any(axis=1))
+    best_bid = bid_prices.max(axis=1)
+    best_ask = np.where(ask_prices > 0, ask_prices,
+                        np.iinfo(np.int64).max).min(axis=1)
+    best_ask[no_book] = best_bid[no_book]
+    mid_prices = format_column((best_bid + best_ask) / 2)
+    mid_prices[no_book] = '0'
+    observed = np.array([symbol == 'DOLPHIN_SIGHTINGS' for symbol in market.symbols])[
+        symbols] & no_book
+    mid_prices[observed] = format_column(
+        market.mid_prices[ticks[observed], symbols[observed]])
+
+    columns = [
+        np.full(len(ticks), str(day), dtype=object),
+        format_column(market.timestamps[ticks]),
+        np.array(market.symbols, dtype=object)[symbols],
+    ]
+    for prices, volumes in ((bid_prices, bid_volumes), (ask_prices, ask_volumes)):
+        for level in range(prices.shape[1]):
+            empty = prices[:, level] <= 0
+            columns.append(format_column(prices[:, level], empty))
+            columns.append(format_column(volumes[:, level], empty))
+    columns.append(mid_prices)
+    columns.append(format_column(profits[ticks, symbols]))
+    return list(map(';'.join, zip(*[column.tolist() for column in columns])))
+
+
+def write_activities(f, day, market: MarketData, profits: np.ndarray):
+    for start in range(0, len(market), ACTIVITIES_CHUNK):
+        rows = activities_rows(day, market, profits,
+                               start, start + ACTIVITIES_CHUNK)
+        if rows:
+            f.write('\n'.join(rows) + '\n')
+
+
+def write_activities_header(f):
+    f.write(f'\n\n')
+    f.write('Submission logs:\n\n\n\n')
+    f.write('Activities log:\n')
+    f.write(csv_header + '\n')
+
+
+def create_log_file(market: MarketData, day, profits: np.ndarray, trader: Trader):
     file_name = uuid.uuid4()
     with open(f'{file_name}.log', 'w', encoding="utf-8", newline='\n') as f:
         f.writelines(log_header)
-        csv_rows = []
         f.write('\n')
-        for time, state in states.items():
-            if hasattr(trader, 'logger'):
-                if hasattr(trader.logger, 'local_logs') != None:
-                    if trader.logger.local_logs.get(time) != None:
-                        f.write(f'{time} {trader.logger.local_logs[time]}\n')
-                        continue
-            if time != 0:
-                f.write(f'{time}\n')
-
-        f.write(f'\n\n')
-        f.write('Submission logs:\n\n\n\n')
-        f.write('Activities log:\n')
-        f.write(csv_header)
-        for time, state in states.items():
-            for symbol in SYMBOLS:
-                f.write(f'{day};{time};{symbol};')
-                bids_length = len(state.order_depths[symbol].buy_orders)
-                bids = list(state.order_depths[symbol].buy_orders.items())
-                bids_prices = list(
-                    state.order_depths[symbol].buy_orders.keys())
-                bids_prices.sort()
-                asks_length = len(state.order_depths[symbol].sell_orders)
-                asks_prices = list(
-                    state.order_depths[symbol].sell_orders.keys())
-                asks_prices.sort()
-                asks = list(state.order_depths[symbol].sell_orders.items())
-                if bids_length >= 3:
-                    f.write(
-                        f'{bids[0][0]};{bids[0][1]};{bids[1][0]};{bids[1][1]};{bids[2][0]};{bids[2][1]};')
-                elif bids_length == 2:
-                    f.write(
-                        f'{bids[0][0]};{bids[0][1]};{bids[1][0]};{bids[1][1]};;;')
-                elif bids_length == 1:
-                    f.write(f'{bids[0][0]};{bids[0][1]};;;;;')
-                else:
-                    f.write(f';;;;;;')
-                if asks_length >= 3:
-                    f.write(
-                        f'{asks[0][0]};{asks[0][1]};{asks[1][0]};{asks[1][1]};{asks[2][0]};{asks[2][1]};')
-                elif asks_length == 2:
-                    f.write(
-                        f'{asks[0][0]};{asks[0][1]};{asks[1][0]};{asks[1][1]};;;')
-                elif asks_length == 1:
-                    f.write(f'{asks[0][0]};{asks[0][1]};;;;;')
-                else:
-                    f.write(f';;;;;;')
-                if len(asks_prices) == 0 or max(bids_prices) == 0:
-                    if symbol == 'DOLPHIN_SIGHTINGS':
-                        dolphin_sightings = state.observations['DOLPHIN_SIGHTINGS']
-                        f.write(
-                            f'{dolphin_sightings};{profits[time][symbol]}\n')
-                    else:
-                        f.write(f'{0};{profits[time][symbol]}\n')
-                else:
-                    min_ask = min(asks_prices)
-                    max_bid = max(bids_prices)
-                    median_price = statistics.median([min_ask, max_bid])
-                    f.write(f'{median_price};{profits[time][symbol]}\n')
+        f.write(sandbox_log(market.timestamps.tolist(), trader))
+        write_activities_header(f)
+        write_activities(f, day, market, profits)
+
+
+class StreamingLog:
+    # Writes the same file as create_log_file one market chunk at a time.
+    # The sandbox section goes straight to the log file, the activities
+    # section is spooled to a temporary file and appended on close.
+    def __init__(self, day, trader: Trader):
+        self.day = day
+        self.trader = trader
+        self.file_name = f'{uuid.uuid4()}.log'
+        self.sandbox = open(self.file_name, 'w',
+                            encoding="utf-8", newline='\n')
+        self.activities = tempfile.TemporaryFile(
+            'w+', encoding="utf-8", newline='\n')
+        self.sandbox.writelines(log_header)
+        self.sandbox.write('\n')
+
+    def write_market(self, market: MarketData, profits: np.ndarray):
+        self.sandbox.write(sandbox_log(
+            market.timestamps.tolist(), self.trader, pop=True))
+        write_activities(self.activities, self.day, market, profits)
+
+    def close(self):
+        write_activities_header(self.sandbox)
+        self.activities.seek(0)
+        shutil.copyfileobj(self.activities, self.sandbox)
+        self.activities.close()
+        self.sandbox.close()
 
 
 # Adjust accordingly the round and day to your needs
@@ -11,6 +11,8 @@ Observation = int
 
 
 class Listing:
+    __slots__ = ('symbol', 'product', 'denomination')
+
     def __init__(self, symbol: Symbol, product: Product, denomination: Product):
         self.symbol = symbol
         self.product = product
@@ -18,6 +20,8 @@ class Listing:
 
 
 class Order:
+    __slots__ = ('symbol', 'price', 'quantity')
+
     def __init__(self, symbol: Symbol, price: int, quantity: int) -> None:
         self.symbol = symbol
         self.price = price
@@ -31,12 +35,16 @@ class Order:
 
 
 class OrderDepth:
+    __slots__ = ('buy_orders', 'sell_orders')
+
     def __init__(self):
         self.buy_orders: Dict[int, int] = {}
         self.sell_orders: Dict[int, int] = {}
 
 
 class Trade:
+    __slots__ = ('symbol', 'price', 'quantity', 'buyer', 'seller', 'timestamp')
+
     def __init__(self, symbol: Symbol, price: int, quantity: int, buyer: UserId = None, seller: UserId = None, timestamp: int = 0) -> None:
         self.symbol = symbol
         self.price: int = price
@@ -47,6 +55,9 @@ class Trade:
 
 
 class TradingState(object):
+    __slots__ = ('timestamp', 'listings', 'order_depths', 'own_trades',
+                 'market_trades', 'position', 'observations')
+
     def __init__(self,
                  timestamp: Time,
                  listings: Dict[Symbol, Listing],
@@ -64,9 +75,16 @@ class TradingState(object):
         self.observations = observations
 
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True)
+        return json.dumps(self, default=attributes, sort_keys=True)
+
+
+def attributes(o) -> dict:
+    # the datamodel classes use __slots__ and have no __dict__
+    if hasattr(o, '__slots__'):
+        return {name: getattr(o, name) for name in o.__slots__}
+    return o.__dict__
 
 
 class ProsperityEncoder(JSONEncoder):
     def default(self, o):
-        return o.__dict__
+        return attributes(o)
@@ -0,0 +1,321 @@
+from datamodel import *
+from typing import Iterator, Optional
+import numpy as np
+import pandas as pd
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# Number of book levels in the prices csv files
+BOOK_LEVELS = 3
+
+BID_PRICE_COLUMNS = [f'bid_price_{i}' for i in range(1, BOOK_LEVELS + 1)]
+BID_VOLUME_COLUMNS = [f'bid_volume_{i}' for i in range(1, BOOK_LEVELS + 1)]
+ASK_PRICE_COLUMNS = [f'ask_price_{i}' for i in range(1, BOOK_LEVELS + 1)]
+ASK_VOLUME_COLUMNS = [f'ask_volume_{i}' for i in range(1, BOOK_LEVELS + 1)]
+
+
+class MarketData:
+    # Columnar view of one day of prices and trades.
+    # Book levels live in (ticks x symbols x levels) arrays, a price of 0
+    # marks an empty level. TradingState objects are only built on demand.
+    def __init__(self,
+                 timestamps: np.ndarray,
+                 symbols: List[Symbol],
+                 present: np.ndarray,
+                 bid_prices: np.ndarray,
+                 bid_volumes: np.ndarray,
+                 ask_prices: np.ndarray,
+                 ask_volumes: np.ndarray,
+                 mid_prices: np.ndarray):
+        self.timestamps = timestamps
+        self.symbols = symbols
+        self.present = present
+        self.bid_prices = bid_prices
+        self.bid_volumes = bid_volumes
+        self.ask_prices = ask_prices
+        self.ask_volumes = ask_volumes
+        self.mid_prices = mid_prices
+        # trades are sorted by tick, trade_offsets[i]:trade_offsets[i + 1]
+        # are the market trades of tick i
+        self.trade_offsets = np.zeros(len(timestamps) + 1, dtype=np.int64)
+        self.trade_symbols = np.empty(0, dtype=object)
+        self.trade_prices = np.empty(0, dtype=np.int64)
+        self.trade_quantities = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def from_prices(cls, df_prices: pd.DataFrame, time_limit: int) -> 'MarketData':
+        df = df_prices[df_prices['timestamp'] <= time_limit]
+        timestamps, tick_idx = np.unique(
+            df['timestamp'].to_numpy(np.int64), return_inverse=True)
+        symbols = list(pd.unique(df['product']))
+        symbol_idx = pd.Categorical(df['product'], categories=symbols).codes
+        shape = (len(timestamps), len(symbols))
+
+        def levels(columns: List[str]) -> np.ndarray:
+            values = np.zeros(shape + (BOOK_LEVELS,), dtype=np.int64)
+            values[tick_idx, symbol_idx] = df[columns].fillna(
+                0).to_numpy(np.int64)
+            return values
+
+        present = np.zeros(shape, dtype=bool)
+        present[tick_idx, symbol_idx] = True
+        mid_prices = np.zeros(shape, dtype=np.float64)
+        mid_prices[tick_idx, symbol_idx] = df['mid_price'].fillna(
+            0).to_numpy(np.float64)
+        bid_prices = levels(BID_PRICE_COLUMNS)
+        ask_prices = levels(ASK_PRICE_COLUMNS)
+        # volumes of empty levels are dropped so both arrays agree
+        bid_volumes = np.where(bid_prices > 0, levels(BID_VOLUME_COLUMNS), 0)
+        ask_volumes = np.where(ask_prices > 0, levels(ASK_VOLUME_COLUMNS), 0)
+        return cls(timestamps, symbols, present, bid_prices, bid_volumes,
+                   ask_prices, ask_volumes, mid_prices)
+
+    def add_trades(self, df_trades: pd.DataFrame, time_limit: int):
+        df = df_trades[df_trades['timestamp'] <= time_limit]
+        trade_times = df['timestamp'].to_numpy(np.int64)
+        # trades at timestamps without a book snapshot have no state to go to
+        tick_idx = np.searchsorted(self.timestamps, trade_times)
+        known = tick_idx < len(self.timestamps)
+        known[known] = self.timestamps[tick_idx[known]] == trade_times[known]
+        order = np.argsort(tick_idx[known], kind='stable')
+        tick_idx = tick_idx[known][order]
+        self.trade_symbols = df['symbol'].to_numpy(object)[known][order]
+        self.trade_prices = df['price'].to_numpy(np.int64)[known][order]
+        self.trade_quantities = df['quantity'].to_numpy(np.int64)[
+            known][order]
+        self.trade_offsets = np.searchsorted(
+            tick_idx, np.arange(len(self.timestamps) + 1))
+
+    def until(self, time_limit: int) -> 'MarketData':
+        # first ticks up to time_limit, the arrays are views into this one
+        n = int(np.searchsorted(self.timestamps, time_limit, side='right'))
+        if n == len(self):
+            return self
+        market = MarketData(self.timestamps[:n], self.symbols, self.present[:n],
+                            self.bid_prices[:n], self.bid_volumes[:n],
+                            self.ask_prices[:n], self.ask_volumes[:n],
+                            self.mid_prices[:n])
+        end = int(self.trade_offsets[n])
+        market.trade_offsets = self.trade_offsets[:n + 1]
+        market.trade_symbols = self.trade_symbols[:end]
+        market.trade_prices = self.trade_prices[:end]
+        market.trade_quantities = self.trade_quantities[:end]
+        return market
+
+    def states(self) -> Iterator[TradingState]:
+        for i in range(len(self)):
+            yield self.state(i)
+
+    def state(self, i: int) -> TradingState:
+        time = int(self.timestamps[i])
+        listings = {}
+        depths = {}
+        own_trades: Dict[Symbol, List[Trade]] = {}
+        market_trades: Dict[Symbol, List[Trade]] = {}
+        position: Dict[Product, Position] = {}
+        observations: Dict[Product, Observation] = {}
+        present = self.present[i].tolist()
+        bid_prices = self.bid_prices[i].tolist()
+        bid_volumes = self.bid_volumes[i].tolist()
+        ask_prices = self.ask_prices[i].tolist()
+        ask_volumes = self.ask_volumes[i].tolist()
+        for s, product in enumerate(self.symbols):
+            if not present[s]:
+                continue
+            position[product] = 0
+            own_trades[product] = []
+            market_trades[product] = []
+            listings[product] = Listing(product, product, "1")
+            if product == "DOLPHIN_SIGHTINGS":
+                observations["DOLPHIN_SIGHTINGS"] = float(
+                    self.mid_prices[i, s])
+            depth = OrderDepth()
+            for price, volume in zip(bid_prices[s], bid_volumes[s]):
+                if price > 0:
+                    depth.buy_orders[price] = volume
+            # sell orders carry negative volumes, as on the exchange
+            for price, volume in zip(ask_prices[s], ask_volumes[s]):
+                if price > 0:
+                    depth.sell_orders[price] = -volume
+            depths[product] = depth
+
+        start, end = self.trade_offsets[i], self.trade_offsets[i + 1]
+        if start != end:
+            for symbol, price, quantity in zip(self.trade_symbols[start:end].tolist(),
+                                               self.trade_prices[start:end].tolist(),
+                                               self.trade_quantities[start:end].tolist()):
+                if symbol not in market_trades:
+                    market_trades[symbol] = []
+                market_trades[symbol].append(
+                    Trade(symbol, price, quantity, '', '', time))
+
+        return TradingState(time, listings, depths, own_trades, market_trades, position, observations)
+
+
+# Rows read from the csv files at once when streaming
+STREAM_CHUNKSIZE = 10000
+
+
+def stream_markets(prices_path: str, trades_path: str, time_limit: int, chunksize=STREAM_CHUNKSIZE) -> Iterator[MarketData]:
+    # Yields a day as consecutive MarketData chunks while reading both csv files in chunks.
+    # The last timestamp of a prices chunk may continue in the next chunk,
+    # so its rows are held back until the following chunk arrives.
+    trade_chunks = pd.read_csv(trades_path, sep=';', chunksize=chunksize)
+    pending_trades = []
+    trades_exhausted = False
+
+    def take_trades(until: int) -> pd.DataFrame:
+        nonlocal trades_exhausted
+        while not trades_exhausted and (not pending_trades or pending_trades[-1]['timestamp'].iloc[-1] <= until):
+            chunk = next(trade_chunks, None)
+            if chunk is None:
+                trades_exhausted = True
+            elif len(chunk) > 0:
+                pending_trades.append(chunk)
+        if not pending_trades:
+            return pd.DataFrame(columns=['timestamp', 'symbol', 'price', 'quantity'])
+        trades = pd.concat(pending_trades)
+        pending_trades.clear()
+        later = trades[trades['timestamp'] > until]
+        if len(later) > 0:
+            pending_trades.append(later)
+        return trades[trades['timestamp'] <= until]
+
+    def chunk_market(prices: pd.DataFrame) -> Iterator[MarketData]:
+        if len(prices) == 0:
+            return
+        market = MarketData.from_prices(prices, time_limit)
+        market.add_trades(take_trades(
+            int(market.timestamps[-1])), time_limit)
+        yield market
+
+    held_back = None
+    for chunk in pd.read_csv(prices_path, sep=';', chunksize=chunksize):
+        # the file is in time order, nothing after a chunk starting past
+        # the time limit is needed
+        if len(chunk) > 0 and chunk['timestamp'].iloc[0] > time_limit:
+            break
+        if held_back is not None:
+            chunk = pd.concat([held_back, chunk])
+        chunk = chunk[chunk['timestamp'] <= time_limit]
+        if len(chunk) == 0:
+            continue
+        last_time = chunk['timestamp'].iloc[-1]
+        held_back = chunk[chunk['timestamp'] == last_time]
+        yield from chunk_market(chunk[chunk['timestamp'] != last_time])
+    if held_back is not None:
+        yield from chunk_market(held_back)
+
+
+# Parsed days are cached next to the csv files, one directory per day
+CACHE_DIR = '.cache'
+CACHE_VERSION = 1
+CACHED_ARRAYS = [
+    'timestamps', 'present', 'bid_prices', 'bid_volumes', 'ask_prices',
+    'ask_volumes', 'mid_prices', 'trade_offsets', 'trade_prices', 'trade_quantities'
+]
+
+
+def source_key(paths: List[str]) -> dict:
+    key = {'version': CACHE_VERSION}
+    for path in paths:
+        stat = os.stat(path)
+        key[os.path.basename(path)] = [stat.st_mtime_ns, stat.st_size]
+    return key
+
+
+def cache_dir(prices_path: str) -> str:
+    name = os.path.splitext(os.path.basename(prices_path))[0]
+    return os.path.join(os.path.dirname(prices_path), CACHE_DIR, name)
+
+
+def write_cache(directory: str, key: dict, market: MarketData):
+    # The cache is written into a temporary sibling directory and moved in
+    # place at once, so processes building the same cache at the same time
+    # never see each other's half written files. meta.json is written last.
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    building = tempfile.mkdtemp(
+        dir=parent, prefix=os.path.basename(directory) + '.')
+    try:
+        for name in CACHED_ARRAYS:
+            np.save(os.path.join(building, f'{name}.npy'),
+                    np.ascontiguousarray(getattr(market, name)))
+        trade_symbol_names = sorted(set(market.trade_symbols.tolist()))
+        trade_symbol_ids = np.searchsorted(
+            np.array(trade_symbol_names, dtype=object), market.trade_symbols).astype(np.int32)
+        np.save(os.path.join(building, 'trade_symbol_ids.npy'), trade_symbol_ids)
+        meta = {'key': key, 'symbols': market.symbols,
+                'trade_symbols': trade_symbol_names}
+        with open(os.path.join(building, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        try:
+            os.replace(building, directory)
+        except OSError:
+            # a cache is in the way, it is kept if another process just
+            # wrote the same one and moved aside if it is stale
+            if read_cache(directory, key) is not None:
+                return
+            stale = building + '.stale'
+            try:
+                os.rename(directory, stale)
+            except FileNotFoundError:
+                pass
+            try:
+                os.replace(building, directory)
+            except OSError:
+                pass
+            shutil.rmtree(stale, ignore_errors=True)
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+
+
+def read_cache(directory: str, key: dict) -> Optional[MarketData]:
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta['key'] != key:
+        return None
+    try:
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+                  for name in CACHED_ARRAYS}
+        trade_symbol_ids = np.load(
+            os.path.join(directory, 'trade_symbol_ids.npy'))
+    except (OSError, ValueError):
+        # missing or partial arrays count as no cache
+        return None
+    market = MarketData(arrays['timestamps'], meta['symbols'], arrays['present'],
+                        arrays['bid_prices'], arrays['bid_volumes'],
+                        arrays['ask_prices'], arrays['ask_volumes'],
+                        arrays['mid_prices'])
+    market.trade_offsets = arrays['trade_offsets']
+    market.trade_prices = arrays['trade_prices']
+    market.trade_quantities = arrays['trade_quantities']
+    market.trade_symbols = np.array(
+        meta['trade_symbols'], dtype=object)[trade_symbol_ids]
+    return market
+
+
+def load_cached(prices_path: str, trades_path: str, time_limit: int) -> MarketData:
+    # Memory maps the cached arrays of a day, the csv files are only parsed
+    # (and the cache rebuilt) when their mtime or size changed
+    directory = cache_dir(prices_path)
+    key = source_key([prices_path, trades_path])
+    market = read_cache(directory, key)
+    if market is None:
+        market = MarketData.from_prices(
+            pd.read_csv(prices_path, sep=';'), sys.maxsize)
+        market.add_trades(pd.read_csv(trades_path, sep=';'), sys.maxsize)
+        write_cache(directory, key, market)
+        # the parsed market is used as is if the cache went away again
+        cached = read_cache(directory, key)
+        market = cached if cached is not None else market
+    return market.until(time_limit)
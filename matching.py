@@ -0,0 +1,161 @@
+from datamodel import *
+from marketdata import MarketData
+import numpy as np
+
+# Side of the order walking a ladder
+BUY = 1
+SELL = -1
+
+
+class PriceLadder:
+    # One side of an order book sorted from the best price outwards.
+    # Asks are walked by buy orders from the lowest price up, bids by
+    # sell orders from the highest price down. Volumes are kept positive
+    # and are used up by fills, the OrderDepth it was built from is left as is.
+    def __init__(self, orders: Dict[int, int], side: int):
+        self.side = side
+        self.prices = sorted(orders.keys(), reverse=side == SELL)
+        self.volumes = [abs(orders[price]) for price in self.prices]
+        # index of the best level that still has volume
+        self.level = 0
+
+    def take(self, limit: int, quantity: int) -> list[tuple[int, int]]:
+        # Fills up to quantity against every level priced at limit or better
+        fills = []
+        while quantity > 0 and self.level < len(self.prices):
+            price = self.prices[self.level]
+            if (price - limit) * self.side > 0:
+                break
+            volume = min(quantity, self.volumes[self.level])
+            self.volumes[self.level] -= volume
+            quantity -= volume
+            if self.volumes[self.level] == 0:
+                self.level += 1
+            fills.append((price, volume))
+        return fills
+
+
+class TradeTape:
+    # Market trades of a market chunk sorted by tick, symbol and price,
+    # with running volumes so the trades a resting order can meet at a
+    # tick are a binary search away. Built once per chunk with NumPy.
+    def __init__(self, market: MarketData):
+        symbols = {symbol: s for s, symbol in enumerate(market.symbols)}
+        self.symbols = symbols
+        self.n_ticks = len(market)
+        self.n_symbols = len(symbols)
+        counts = np.diff(market.trade_offsets)
+        ticks = np.repeat(np.arange(len(market)), counts)
+        symbol_idx = np.array([symbols.get(symbol, -1) for symbol in market.trade_symbols.tolist()],
+                              dtype=np.int64)
+        known = symbol_idx >= 0
+        keys = ticks[known] * self.n_symbols + symbol_idx[known]
+        prices = market.trade_prices[known]
+        volumes = np.abs(market.trade_quantities[known])
+        order = np.lexsort((prices, keys))
+        self.prices = prices[order]
+        self.volumes = np.concatenate([[0], np.cumsum(volumes[order])])
+        self.offsets = np.searchsorted(
+            keys[order], np.arange(len(market) * self.n_symbols + 1))
+
+    def levels(self, tick: int, symbol: Symbol, price: int, side: int) -> list[tuple[int, int]]:
+        # Volume traded per price at a tick that a resting order at price on
+        # side could meet: at its price and below for a bid, at its price and
+        # above for an ask, from its price outwards
+        s = self.symbols.get(symbol)
+        if s is None or tick >= self.n_ticks:
+            return []
+        key = tick * self.n_symbols + s
+        start, end = int(self.offsets[key]), int(self.offsets[key + 1])
+        if start == end:
+            return []
+        prices = self.prices[start:end]
+        if side == BUY:
+            high = start + int(np.searchsorted(prices, price, 'right'))
+            bounds = range(start, high)
+        else:
+            low = start + int(np.searchsorted(prices, price, 'left'))
+            bounds = range(low, end)
+        volumes = self.volumes
+        levels: dict[int, int] = {}
+        for k in bounds:
+            level = int(self.prices[k])
+            levels[level] = levels.get(level, 0) + int(volumes[k + 1] - volumes[k])
+        return sorted(levels.items(), reverse=side == BUY)
+
+
+def queue_fill(tape: TradeTape, tick: int, symbol: Symbol, price: int, quantity: int, side: int, queue: int, used: dict[int, int]) -> int:
+    # How much of a resting order is filled by the market trades of a tick.
+    # Trades through the price fill it fully, trades at the price first go
+    # to the queue ahead of it. Orders on a side are filled from the best
+    # price, used holds what they already took per trade price, and each
+    # order takes the trades closest to its own price first so the ones
+    # further out stay for the orders behind it.
+    filled = 0
+    for level, volume in tape.levels(tick, symbol, price, side):
+        if filled == quantity:
+            break
+        available = volume - used.get(level, 0) - (queue if level == price else 0)
+        take = max(0, min(quantity - filled, available))
+        if take > 0:
+            used[level] = used.get(level, 0) + take
+            filled += take
+    return filled
+
+
+# Checks the order matching on books where the order of the fills matters
+if __name__ == "__main__":
+    from bt import clear_order_book
+
+    def filled(orders: list[Order], depth: OrderDepth) -> int:
+        return sum(trade.quantity for trade in clear_order_book({"PEARLS": orders}, {"PEARLS": depth}, 0))
+
+    depth = OrderDepth()
+    depth.sell_orders = {9998: -5, 9999: -10}
+    depth.buy_orders = {10001: 5, 10002: 10}
+    # one order per level, the way trade_pearls sends them
+    assert filled([Order("PEARLS", 9998, 5), Order("PEARLS", 9999, 10)], depth) == 15
+    assert filled([Order("PEARLS", 9999, 10), Order("PEARLS", 9998, 5)], depth) == 15
+    assert filled([Order("PEARLS", 10002, -10), Order("PEARLS", 10001, -5)], depth) == -15
+    # a low bid still gets its level when a higher one is sent too
+    assert filled([Order("PEARLS", 10000, 5), Order("PEARLS", 9998, 5)], depth) == 10
+    # orders do not walk past their limit
+    assert filled([Order("PEARLS", 9998, 10)], depth) == 5
+    assert depth.sell_orders == {9998: -5, 9999: -10}
+
+    # resting bids share the trades of the next tick: the bid at 10000
+    # takes the trades at its price, the ones at 9998 stay for the lower bid
+    ticks = 2
+    empty = np.zeros((ticks, 1, 3), dtype=np.int64)
+    market = MarketData(np.arange(ticks) * 100, ["PEARLS"], np.ones((ticks, 1), dtype=bool),
+                        empty, empty, empty, empty, np.zeros((ticks, 1)))
+    market.trade_offsets = np.array([0, 0, 2])
+    market.trade_symbols = np.array(["PEARLS", "PEARLS"], dtype=object)
+    market.trade_prices = np.array([9998, 10000])
+    market.trade_quantities = np.array([5, 5])
+    tape = TradeTape(market)
+    quiet = OrderDepth()
+    quiet.sell_orders = {10005: -5}
+    for orders in ([Order("PEARLS", 10000, 5), Order("PEARLS", 9998, 5)],
+                   [Order("PEARLS", 9998, 5), Order("PEARLS", 10000, 5)]):
+        assert sum(trade.quantity for trade in clear_order_book({"PEARLS": orders}, {"PEARLS": quiet}, 0, tape, 1)) == 10
+    # book volume queued at a price goes first
+    quiet.buy_orders = {9998: 3}
+    assert sum(trade.quantity for trade in clear_order_book(
+        {"PEARLS": [Order("PEARLS", 9998, 5)]}, {"PEARLS": quiet}, 0, tape, 1)) == 2
+
+    # the end of day liquidation walks what the orders of the last tick
+    # left of the book, the bid at 10001 can not be sold into twice
+    from accounting import Accounting
+    from bt import liquidate_leftovers
+    depth = OrderDepth()
+    depth.buy_orders = {10001: 5, 9000: 50}
+    books = Accounting()
+    books.fill("PEARLS", 10000, 10)
+    ladders = {}
+    for trade in clear_order_book({"PEARLS": [Order("PEARLS", 10001, -5)]}, {"PEARLS": depth}, 0, ladders=ladders):
+        books.fill(trade.symbol, trade.price, trade.quantity)
+    liquidate_leftovers(books, TradingState(0, {}, {"PEARLS": depth}, {}, {}, {}, {}), ladders=ladders)
+    assert books.position["PEARLS"] == 0
+    assert books.cash["PEARLS"] == -100000 + 5 * 10001 + 5 * 9000
+    print("matching ok")
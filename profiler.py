@@ -0,0 +1,151 @@
+from trader import Trader
+
+from bt import simulate_alternative
+from contextlib import redirect_stdout
+from typing import Any, Callable
+import pandas as pd
+import functools
+import os
+import sys
+import time
+
+# Trader.run time above which a tick is flagged
+TICK_BUDGET_MS = 100.0
+
+# Phases marked by the backtester, they add up to the whole tick. state
+# also holds the trader's copy of the state and its books rows, trader is
+# Trader.run alone, trader_0, trader_1, ... when several run in lockstep.
+PHASES = ['state', 'trader', 'matching', 'pnl', 'logging']
+
+# Methods of the trader (and its logger) that are timed on their own
+TRADER_METHODS = [
+    'trade_pearls',
+    'trade_berries',
+    'trade_coconut_pinacoladas',
+]
+LOGGER_METHODS = [
+    'flush',
+]
+
+
+class TickProfiler:
+    # Records wall time and the change in live memory blocks
+    # (sys.getallocatedblocks, allocations minus frees) of every tick,
+    # split into backtester phases (state, trader, matching, pnl, logging)
+    # and the strategy methods the trader calls inside its run.
+    def __init__(self, budget_ms=TICK_BUDGET_MS) -> None:
+        self.budget_ms = budget_ms
+        self.timestamps: list[int] = []
+        self.ticks: list[dict[str, float]] = []
+        self.blocks: list[dict[str, int]] = []
+        self.current: dict[str, float] = {}
+        self.current_blocks: dict[str, int] = {}
+        self.last = 0.0
+        self.last_blocks = 0
+
+    def start(self) -> None:
+        self.last = time.perf_counter()
+        self.last_blocks = sys.getallocatedblocks()
+
+    def add(self, name: str, seconds: float, blocks: int) -> None:
+        self.current[name] = self.current.get(name, 0.0) + seconds
+        self.current_blocks[name] = self.current_blocks.get(
+            name, 0) + blocks
+
+    def mark(self, phase: str) -> None:
+        # everything since the previous mark belongs to phase
+        now = time.perf_counter()
+        blocks = sys.getallocatedblocks()
+        self.add(phase, now - self.last, blocks - self.last_blocks)
+        self.last = now
+        self.last_blocks = blocks
+
+    def end_tick(self, timestamp: int) -> None:
+        self.timestamps.append(timestamp)
+        self.ticks.append(self.current)
+        self.blocks.append(self.current_blocks)
+        self.current = {}
+        self.current_blocks = {}
+
+    def timed(self, name: str, method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start, start_blocks = time.perf_counter(), sys.getallocatedblocks()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start,
+                         sys.getallocatedblocks() - start_blocks)
+        return wrapper
+
+    def instrument(self, trader: Any) -> Callable[[], None]:
+        # Times the strategy methods on this trader instance only,
+        # the returned function puts the original methods back
+        wrapped = []
+        targets = [(trader, TRADER_METHODS, '')]
+        if hasattr(trader, 'logger'):
+            targets.append((trader.logger, LOGGER_METHODS, 'logger.'))
+        for target, names, prefix in targets:
+            for name in names:
+                if hasattr(target, name):
+                    setattr(target, name, self.timed(
+                        prefix + name, getattr(target, name)))
+                    wrapped.append((target, name))
+
+        def restore():
+            for target, name in wrapped:
+                delattr(target, name)
+        return restore
+
+    def phases(self, columns) -> list[str]:
+        return [column for column in columns if column in PHASES or column.startswith('trader_')]
+
+    def runs(self, columns) -> list[str]:
+        # the Trader.run phases, one per trader
+        return [column for column in columns if column == 'trader' or column.startswith('trader_')]
+
+    def frame(self, values: list[dict[str, float]]) -> pd.DataFrame:
+        return pd.DataFrame(values, index=pd.Index(self.timestamps, name='timestamp')).fillna(0)
+
+    def report(self) -> pd.DataFrame:
+        # p50/p99/max per phase and method in ms, with the median and the
+        # largest change in live blocks. It is negative where more was freed
+        # than allocated, it is not a count of allocations.
+        times = self.frame(self.ticks) * 1000
+        times['tick'] = times[self.phases(times.columns)].sum(axis=1)
+        blocks = self.frame(self.blocks).reindex(columns=times.columns, fill_value=0)
+        blocks['tick'] = blocks[self.phases(blocks.columns)].sum(axis=1)
+        return pd.DataFrame({
+            'p50_ms': times.median(),
+            'p99_ms': times.quantile(0.99),
+            'max_ms': times.max(),
+            'total_ms': times.sum(),
+            'p50_net_blocks': blocks.median(),
+            'max_net_blocks': blocks.max(),
+        })
+
+    def over_budget(self) -> pd.DataFrame:
+        # ticks where a Trader.run took longer than the budget
+        times = self.frame(self.ticks) * 1000
+        runs = self.runs(times.columns)
+        if not runs:
+            return times
+        return times[(times[runs] > self.budget_ms).any(axis=1)]
+
+    def print_report(self) -> None:
+        print(self.report().to_string(float_format=lambda v: f'{v:.3f}'))
+        slow = self.over_budget()
+        print(f'{len(slow)} of {len(self.ticks)} ticks exceeded the budget of {self.budget_ms} ms in Trader.run')
+        if len(slow) > 0:
+            slowest = slow[self.runs(slow.columns)].max(axis=1).sort_values(ascending=False)
+            print(slow.loc[slowest.index[:10]].to_string(
+                float_format=lambda v: f'{v:.3f}'))
+
+
+# Profiles Trader.run on one day of training data
+if __name__ == "__main__":
+    profiler = TickProfiler()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        simulate_alternative(3, 1, Trader(), write_log=False,
+                             profiler=profiler)
+    profiler.print_report()
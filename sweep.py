@@ -0,0 +1,95 @@
+from trader import Trader
+
+from accounting import Accounting
+from bt import load_market, simulate_markets
+from batch import available_days
+from marketdata import MarketData
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from typing import Any
+import numpy as np
+import pandas as pd
+import itertools
+import os
+
+# Market data of every day in the sweep, memory mapped once per worker
+# process by share_markets and only ever read afterwards
+shared_markets: dict[tuple[int, int], MarketData] = {}
+
+
+def grid(space: dict[str, list]) -> list[dict[str, Any]]:
+    keys = list(space.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*space.values())]
+
+
+def random_sample(space: dict[str, Any], n: int, seed=0) -> list[dict[str, Any]]:
+    # a list is sampled from, a (low, high) tuple is sampled uniformly
+    rng = np.random.default_rng(seed)
+    configs = []
+    for _ in range(n):
+        config = {}
+        for key, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    config[key] = int(rng.integers(low, high + 1))
+                else:
+                    config[key] = float(rng.uniform(low, high))
+            else:
+                config[key] = values[rng.integers(len(values))]
+        configs.append(config)
+    return configs
+
+
+def share_markets(days: list[tuple[int, int]], time_limit: int):
+    global shared_markets
+    shared_markets = {(round, day): load_market(round, day, time_limit)
+                      for round, day in days}
+
+
+def evaluate(config: dict[str, Any]) -> dict[tuple[int, int], dict[str, float]]:
+    # Accounting.summary of every day
+    summaries = {}
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for (round, day), market in shared_markets.items():
+            trader = Trader(**config)
+            accounting = Accounting()
+            simulate_markets([market], day, trader,
+                             write_log=False, accounting=accounting)
+            summaries[(round, day)] = accounting.summary()
+    return summaries
+
+
+def run_sweep(configs: list[dict[str, Any]], days=None, max_workers=None, time_limit=999900) -> pd.DataFrame:
+    # Every day is parsed into the binary cache once here, the workers
+    # memory map the same cache files and share their pages read-only
+    days = available_days() if days is None else days
+    for round, day in days:
+        load_market(round, day, time_limit)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=share_markets, initargs=(days, time_limit)) as pool:
+        results = list(pool.map(evaluate, configs))
+    rows = []
+    for config, summaries in zip(configs, results):
+        row = dict(config)
+        for (round, day), summary in summaries.items():
+            row[f'round_{round}_day_{day}'] = summary['pnl']
+        row['pnl'] = sum(summary['pnl'] for summary in summaries.values())
+        # the worst day counts for the risk columns
+        row['max_drawdown'] = max(
+            (summary['max_drawdown'] for summary in summaries.values()), default=0.0)
+        row['max_exposure'] = max(
+            (summary['max_exposure'] for summary in summaries.values()), default=0.0)
+        rows.append(row)
+    ranking = pd.DataFrame(rows)
+    return ranking.sort_values('pnl', ascending=False, ignore_index=True)
+
+
+# Sweeps the pair trade ratio band of COCONUTS and PINA_COLADAS
+if __name__ == "__main__":
+    configs = grid({
+        'pair_upper_ratio': [1.872, 1.874, 1.876, 1.878],
+        'pair_lower_ratio': [1.870, 1.872, 1.874, 1.876],
+    })
+    configs = [c for c in configs if c['pair_lower_ratio']
+               <= c['pair_upper_ratio']]
+    print(run_sweep(configs).to_string())
@@ -0,0 +1,179 @@
+from bt import TIME_DELTA, TRAINING_DATA_PREFIX, csv_header, write_activities
+from marketdata import BOOK_LEVELS, MarketData
+from typing import Optional
+import numpy as np
+import pandas as pd
+import argparse
+import os
+
+# Traded products: starting mid price, standard deviation of the mid
+# price change per tick, the widest half spread and the standard deviation
+# of a noise around the mid that does not add up over ticks. PEARLS stays
+# around 10000 but its book crosses that value now and then.
+PRODUCTS = {
+    'PEARLS': (10000, 0.0, 2, 1.5),
+    'BANANAS': (4900, 1.0, 2, 0.0),
+    'COCONUTS': (8000, 1.5, 1, 0.0),
+    'PINA_COLADAS': (15000, 2.8, 1, 0.0),
+    'DIVING_GEAR': (99000, 10.0, 1, 0.0),
+    'BERRIES': (3900, 1.0, 1, 0.0),
+}
+# Observation only products: starting value and change per tick,
+# they have an empty book and the value in mid_price. bt.py only reads
+# DOLPHIN_SIGHTINGS as an observation.
+OBSERVATIONS = {
+    'DOLPHIN_SIGHTINGS': (3000.0, 1.0),
+}
+# PINA_COLADAS follows COCONUTS with this correlation of the mid price changes
+PAIR = ('COCONUTS', 'PINA_COLADAS')
+# Average number of market trades per product and tick
+TRADE_RATE = 0.05
+MAX_VOLUME = 30
+TRADES_HEADER = ['timestamp', 'buyer', 'seller',
+                 'symbol', 'currency', 'price', 'quantity']
+
+
+def generate_market(ticks=10000, products: Optional[dict] = None, observations: Optional[dict] = None, volatility=1.0,
+                    spread=1.0, correlation=0.9, trade_rate=TRADE_RATE, seed=0) -> MarketData:
+    # One synthetic day as MarketData. volatility and spread scale the
+    # values in products, correlation is the correlation of the COCONUTS
+    # and PINA_COLADAS mid price changes.
+    products = PRODUCTS if products is None else products
+    observations = OBSERVATIONS if observations is None else observations
+    rng = np.random.default_rng(seed)
+    names = list(products)
+    symbols = names + list(observations)
+    starts = np.array([products[name][0] for name in names], dtype=np.float64)
+    steps = np.array([products[name][1] for name in names]) * volatility
+    half_spreads = np.maximum(
+        1, np.round(np.array([products[name][2] for name in names]) * spread)).astype(np.int64)
+    noise = np.array([products[name][3] for name in names]) * volatility
+    timestamps = np.arange(ticks, dtype=np.int64) * TIME_DELTA
+
+    shocks = rng.standard_normal((ticks, len(names)))
+    if PAIR[0] in names and PAIR[1] in names:
+        first, second = names.index(PAIR[0]), names.index(PAIR[1])
+        shocks[:, second] = correlation * shocks[:, first] + \
+            np.sqrt(1 - correlation ** 2) * shocks[:, second]
+    shocks[0] = 0
+    centers = np.round(starts + np.cumsum(shocks * steps, axis=0) +
+                       rng.standard_normal(shocks.shape) * noise).astype(np.int64)
+
+    shape = (ticks, len(names))
+    half = rng.integers(1, half_spreads + 1, size=shape)
+    best_bids, best_asks = centers - half, centers + half
+    level = np.arange(BOOK_LEVELS)
+    bid_levels = rng.integers(1, BOOK_LEVELS + 1, size=shape)[..., None]
+    ask_levels = rng.integers(1, BOOK_LEVELS + 1, size=shape)[..., None]
+    # (ticks x symbols x levels), observations have no book
+    books = np.zeros((ticks, len(symbols), BOOK_LEVELS), dtype=np.int64)
+    bid_prices, ask_prices = books.copy(), books.copy()
+    bid_volumes, ask_volumes = books.copy(), books.copy()
+    bid_prices[:, :len(names)] = np.where(level < bid_levels, best_bids[..., None] - level, 0)
+    ask_prices[:, :len(names)] = np.where(level < ask_levels, best_asks[..., None] + level, 0)
+    bid_volumes[:, :len(names)] = np.where(level < bid_levels,
+                                           rng.integers(1, MAX_VOLUME, size=shape + (BOOK_LEVELS,)), 0)
+    ask_volumes[:, :len(names)] = np.where(level < ask_levels,
+                                           rng.integers(1, MAX_VOLUME, size=shape + (BOOK_LEVELS,)), 0)
+
+    mid_prices = np.zeros((ticks, len(symbols)))
+    mid_prices[:, :len(names)] = (best_bids + best_asks) / 2
+    for s, (start, step) in enumerate(observations.values(), start=len(names)):
+        mid_prices[:, s] = np.round(
+            start + np.cumsum(rng.standard_normal(ticks) * step * volatility), 1)
+    market = MarketData(timestamps, symbols, np.ones((ticks, len(symbols)), dtype=bool),
+                        bid_prices, bid_volumes, ask_prices, ask_volumes, mid_prices)
+
+    # Market trades hit the best bid or lift the best ask of their tick,
+    # cells run through ticks in order so the trades come out sorted
+    counts = rng.poisson(trade_rate, size=shape)
+    cells = np.repeat(np.arange(ticks * len(names)), counts.ravel())
+    buys = rng.random(len(cells)) < 0.5
+    market.trade_offsets = np.concatenate([[0], np.cumsum(counts.sum(axis=1))])
+    market.trade_symbols = np.array(names, dtype=object)[cells % len(names)]
+    market.trade_prices = np.where(buys, best_asks.ravel()[cells], best_bids.ravel()[cells])
+    market.trade_quantities = rng.integers(1, MAX_VOLUME // 3, size=len(cells))
+    return market
+
+
+def trades_frame(market: MarketData) -> pd.DataFrame:
+    ticks = np.repeat(np.arange(len(market)), np.diff(market.trade_offsets))
+    return pd.DataFrame({
+        'timestamp': market.timestamps[ticks],
+        'buyer': '',
+        'seller': '',
+        'symbol': market.trade_symbols,
+        'currency': 'SEASHELLS',
+        'price': market.trade_prices.astype(np.float64),
+        'quantity': market.trade_quantities,
+    }, columns=TRADES_HEADER)
+
+
+def prices_frame(market: MarketData, day=0) -> pd.DataFrame:
+    # the rows of the prices csv, empty levels are nan
+    ticks, symbols = np.nonzero(market.present)
+    columns = {
+        'day': np.full(len(ticks), day),
+        'timestamp': market.timestamps[ticks],
+        'product': np.array(market.symbols, dtype=object)[symbols],
+    }
+    for side, prices, volumes in (('bid', market.bid_prices, market.bid_volumes),
+                                  ('ask', market.ask_prices, market.ask_volumes)):
+        for i in range(BOOK_LEVELS):
+            empty = prices[ticks, symbols, i] <= 0
+            columns[f'{side}_price_{i + 1}'] = np.where(empty, np.nan, prices[ticks, symbols, i])
+            columns[f'{side}_volume_{i + 1}'] = np.where(empty, np.nan, volumes[ticks, symbols, i])
+    columns['mid_price'] = market.mid_prices[ticks, symbols]
+    columns['profit_and_loss'] = 0.0
+    return pd.DataFrame(columns)
+
+
+def generate(day=0, **kwargs) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # prices and trades frames as pd.read_csv gives them, kwargs go to generate_market
+    market = generate_market(**kwargs)
+    return prices_frame(market, day), trades_frame(market)
+
+
+def write_day(round: int, day: int, prefix=TRAINING_DATA_PREFIX, force=False, **kwargs) -> tuple[str, str]:
+    # Writes prices_round_{round}_day_{day}.csv and the matching trades
+    # file where bt.py looks for them, kwargs go to generate_market.
+    # Existing files, real training days included, are only replaced with
+    # force. The prices file has the layout of the activities log, so it
+    # is written by the same code.
+    prices_path = f"{prefix}/prices_round_{round}_day_{day}.csv"
+    trades_path = f"{prefix}/trades_round_{round}_day_{day}_nn.csv"
+    existing = [path for path in (prices_path, trades_path) if os.path.exists(path)]
+    if existing and not force:
+        raise FileExistsError(
+            f'{" and ".join(existing)} already exist, pass force=True (--force) to overwrite')
+    market = generate_market(**kwargs)
+    os.makedirs(prefix, exist_ok=True)
+    with open(prices_path, 'w') as f:
+        f.write(csv_header + '\n')
+        write_activities(f, day, market, np.zeros(market.mid_prices.shape))
+    trades_frame(market).to_csv(trades_path, sep=';', index=False)
+    return prices_path, trades_path
+
+
+# Writes synthetic days into the training directory
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Generates prices and trades files of synthetic days')
+    parser.add_argument('--round', type=int, default=0)
+    parser.add_argument('--days', type=int, nargs='*', default=[0])
+    parser.add_argument('--ticks', type=int, default=10000)
+    parser.add_argument('--volatility', type=float, default=1.0)
+    parser.add_argument('--spread', type=float, default=1.0)
+    parser.add_argument('--correlation', type=float, default=0.9)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefix', default=TRAINING_DATA_PREFIX)
+    parser.add_argument('--force', action='store_true',
+                        help='overwrite prices and trades files that already exist')
+    args = parser.parse_args()
+    for day in args.days:
+        try:
+            paths = write_day(args.round, day, args.prefix, args.force, ticks=args.ticks, volatility=args.volatility,
+                              spread=args.spread, correlation=args.correlation, seed=args.seed + day)
+        except FileExistsError as error:
+            parser.error(str(error))
+        print(*paths)
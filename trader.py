@@ -1,7 +1,64 @@
 import json
-from typing import Dict, List, Any
+import math
+import numpy as np
+from typing import Dict, List, Any, Optional
 from datamodel import *
-from collections import defaultdict
+
+
+# The log line is put together from pre-built pieces instead of going
+# through json.dumps with a default hook. It is byte for byte what
+# json.dumps(..., cls=ProsperityEncoder, separators=(",", ":"), sort_keys=True)
+# gives for the datamodel classes.
+encode_json = json.JSONEncoder(
+    separators=(",", ":"), sort_keys=True, check_circular=False).encode
+encode_string = json.encoder.encode_basestring_ascii
+
+
+def encode_order_depths(order_depths: Dict[Symbol, OrderDepth]) -> str:
+    return encode_json({symbol: {"buy_orders": depth.buy_orders, "sell_orders": depth.sell_orders}
+                        for symbol, depth in order_depths.items()})
+
+
+def encode_trades(trades: Dict[Symbol, List[Trade]]) -> str:
+    return "{" + ",".join([encode_string(symbol) + ":" + (encode_json(
+        [{"buyer": t.buyer, "price": t.price, "quantity": t.quantity,
+          "seller": t.seller, "symbol": t.symbol, "timestamp": t.timestamp}
+         for t in symbol_trades]) if symbol_trades else "[]")
+        for symbol, symbol_trades in sorted(trades.items())]) + "}"
+
+
+def encode_orders(orders: Dict[Symbol, List[Order]]) -> str:
+    return encode_json({symbol: [{"price": o.price, "quantity": o.quantity, "symbol": o.symbol}
+                                 for o in symbol_orders] for symbol, symbol_orders in orders.items()})
+
+
+# listings hardly ever change, so their encoding is reused
+encoded_listings: Dict[tuple, str] = {}
+
+
+def encode_listings(listings: Dict[Symbol, Listing]) -> str:
+    key = tuple([(symbol, l.symbol, l.product, l.denomination)
+                for symbol, l in listings.items()])
+    output = encoded_listings.get(key)
+    if output is None:
+        output = encode_json({symbol: {"denomination": l.denomination, "product": l.product, "symbol": l.symbol}
+                              for symbol, l in listings.items()})
+        encoded_listings[key] = output
+    return output
+
+
+def encode_log(state: TradingState, orders: Dict[Symbol, List[Order]], logs: str) -> str:
+    return "".join([
+        '{"logs":', encode_string(logs),
+        ',"orders":', encode_orders(orders),
+        ',"state":{"listings":', encode_listings(state.listings),
+        ',"market_trades":', encode_trades(state.market_trades),
+        ',"observations":', encode_json(state.observations),
+        ',"order_depths":', encode_order_depths(state.order_depths),
+        ',"own_trades":', encode_trades(state.own_trades),
+        ',"position":', encode_json(state.position),
+        ',"timestamp":', encode_json(state.timestamp), "}}",
+    ])
 
 
 class Logger:
@@ -9,38 +66,341 @@ class Logger:
     # local logs
     local: bool
     # this is used as a buffer for logs
-    # instead of stdout
-    local_logs: dict[int, str] = {}
+    # instead of stdout, every logger has its own
+    local_logs: dict[int, str]
 
-    def __init__(self, local=False) -> None:
+    # With a file the log lines are written to it in batches
+    # of batch_size ticks instead of to stdout and local_logs.
+    # With max_local_logs only the latest that many ticks are kept.
+    def __init__(self, local=False, file=None, batch_size=1000, max_local_logs=None) -> None:
         self.logs = ""
         self.local = local
+        self.local_logs = {}
+        self.max_local_logs = max_local_logs
+        self.file = file
+        self.batch_size = batch_size
+        self.batch: list[str] = []
 
     def print(self, *objects: Any, sep: str = " ", end: str = "\n") -> None:
         self.logs += sep.join(map(str, objects)) + end
 
     def flush(self, state: TradingState, orders: dict[Symbol, list[Order]]) -> None:
-        output = json.dumps({
-            "state": state,
-            "orders": orders,
-            "logs": self.logs,
-        }, cls=ProsperityEncoder, separators=(",", ":"), sort_keys=True)
-        if self.local:
-            self.local_logs[state.timestamp] = output
-        print(output)
+        output = encode_log(state, orders, self.logs)
+        if self.file is not None:
+            self.batch.append(output + "\n")
+            if len(self.batch) >= self.batch_size:
+                self.write_batch()
+        else:
+            if self.local:
+                self.local_logs[state.timestamp] = output
+                if self.max_local_logs is not None and len(self.local_logs) > self.max_local_logs:
+                    # dicts keep insertion order, the first key is the oldest tick
+                    del self.local_logs[next(iter(self.local_logs))]
+            print(output)
 
         self.logs = ""
 
+    def write_batch(self) -> None:
+        if self.file is not None and self.batch:
+            self.file.write("".join(self.batch))
+            self.batch.clear()
+
+    # Writes what is left of the batch, the file itself stays open for
+    # whoever passed it in. The backtester calls this at the end of a run.
+    def close(self) -> None:
+        self.write_batch()
+        if self.file is not None:
+            self.file.flush()
+
+    def __enter__(self) -> "Logger":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class RingBuffer:
+    # Fixed capacity history with O(1) appends. Appends go to a list and
+    # are copied into the array in one go when the history is read or the
+    # list is full. Every value is written twice, capacity apart, so the
+    # latest n values are always one contiguous slice and window returns
+    # a view instead of a copy.
+    __slots__ = ("capacity", "data", "head", "size", "pending")
+
+    def __init__(self, capacity: int, dtype=np.float64) -> None:
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=dtype)
+        self.head = 0
+        self.size = 0
+        self.pending = []
+
+    def append(self, value) -> None:
+        pending = self.pending
+        pending.append(value)
+        if len(pending) == self.capacity:
+            self.flush()
+
+    def flush(self) -> None:
+        pending, capacity = self.pending, self.capacity
+        if not pending:
+            return
+        values = np.asarray(pending, dtype=self.data.dtype)
+        pending.clear()
+        n = len(values)
+        slots = (self.head + np.arange(n)) % capacity
+        self.data[slots] = values
+        self.data[slots + capacity] = values
+        self.head = (self.head + n) % capacity
+        self.size = min(self.size + n, capacity)
+
+    def window(self, n: Optional[int] = None) -> np.ndarray:
+        # the latest n values, oldest first
+        self.flush()
+        n = self.size if n is None else min(n, self.size)
+        end = self.head + self.capacity
+        return self.data[end - n:end]
+
+    @property
+    def last(self):
+        self.flush()
+        return self.data[self.head + self.capacity - 1] if self.size else None
+
+    def __len__(self) -> int:
+        return min(self.size + len(self.pending), self.capacity)
+
+
+class SymbolHistory:
+    # Latest mid prices and traded volumes per tick and the latest
+    # market trades of one symbol
+    __slots__ = ("mids", "volumes", "trade_prices", "trade_quantities")
+
+    def __init__(self, capacity: int, trade_capacity: int) -> None:
+        self.mids = RingBuffer(capacity)
+        self.volumes = RingBuffer(capacity, np.int64)
+        self.trade_prices = RingBuffer(trade_capacity)
+        self.trade_quantities = RingBuffer(trade_capacity, np.int64)
 
-class Trader:
 
-    logger = Logger(local=True)
+# marks a BookFeatures value that has not been worked out yet
+UNSET = object()
 
-    def __init__(self) -> None:
-        self.trade_prices = defaultdict(list)
+
+class BookFeatures:
+    # What the strategies read from one order depth, kept for the symbol
+    # and tick. It starts from the best prices Features.update already
+    # found, everything else is worked out on first read and kept, so a
+    # strategy only pays for what it reads. Ask volumes keep the negative
+    # sign of sell_orders, the best prices are None on an empty side.
+    __slots__ = ("depth", "best_ask", "best_ask_volume", "best_bid", "best_bid_volume",
+                 "_asks", "_bids", "_weighted_ask", "_weighted_bid", "_microprice")
+
+    def __init__(self, depth: OrderDepth, best_bid: Optional[int], best_ask: Optional[int]) -> None:
+        self.depth = depth
+        self.best_ask = best_ask
+        self.best_ask_volume = depth.sell_orders[best_ask] if best_ask is not None else 0
+        self.best_bid = best_bid
+        self.best_bid_volume = depth.buy_orders[best_bid] if best_bid is not None else 0
+        self._asks = self._bids = None
+        self._weighted_ask = self._weighted_bid = self._microprice = UNSET
+
+    @property
+    def asks(self) -> List[int]:
+        if self._asks is None:
+            self._asks = sorted(self.depth.sell_orders)
+        return self._asks
+
+    @property
+    def bids(self) -> List[int]:
+        if self._bids is None:
+            self._bids = sorted(self.depth.buy_orders, reverse=True)
+        return self._bids
+
+    @property
+    def mid(self) -> Optional[float]:
+        if self.best_ask is None or self.best_bid is None:
+            return None
+        return (self.best_ask + self.best_bid) / 2
+
+    @property
+    def spread(self) -> Optional[int]:
+        if self.best_ask is None or self.best_bid is None:
+            return None
+        return self.best_ask - self.best_bid
+
+    @property
+    def weighted_ask(self) -> Optional[float]:
+        if self._weighted_ask is UNSET:
+            self._weighted_ask = weighted_price(self.depth.sell_orders)
+        return self._weighted_ask
+
+    @property
+    def weighted_bid(self) -> Optional[float]:
+        if self._weighted_bid is UNSET:
+            self._weighted_bid = weighted_price(self.depth.buy_orders)
+        return self._weighted_bid
+
+    @property
+    def microprice(self) -> Optional[float]:
+        # best prices weighted by the volume on the other side
+        if self._microprice is UNSET:
+            mid = self.mid
+            ask_volume, bid_volume = -self.best_ask_volume, self.best_bid_volume
+            if mid is None or ask_volume + bid_volume == 0:
+                self._microprice = mid
+            else:
+                self._microprice = (self.best_bid * ask_volume + self.best_ask * bid_volume) / \
+                    (ask_volume + bid_volume)
+        return self._microprice
+
+
+def weighted_price(orders: Dict[int, int]) -> Optional[float]:
+    # price of a side weighted by the volume at every level
+    volume = sum(abs(v) for v in orders.values())
+    if volume == 0:
+        return None
+    return sum(p * abs(v) for p, v in orders.items()) / volume
+
+
+class TradeStats:
+    # Exponentially weighted statistics of the market trades of one
+    # symbol, every trade updates them in O(1) without keeping history
+    __slots__ = ("alpha", "last_price", "ema", "vwap_value", "vwap_volume", "variance", "count")
+
+    def __init__(self, alpha: float) -> None:
+        self.alpha = alpha
+        self.last_price = None
+        self.ema = None
+        self.vwap_value = 0.0
+        self.vwap_volume = 0.0
+        self.variance = 0.0
+        self.count = 0
+
+    def add(self, price: float, quantity: int) -> None:
+        alpha = self.alpha
+        volume = abs(quantity)
+        if self.last_price is None:
+            self.ema = float(price)
+        else:
+            change = price - self.last_price
+            self.variance = (1 - alpha) * (self.variance + alpha * change * change)
+            self.ema += alpha * (price - self.ema)
+        self.vwap_value = (1 - alpha) * self.vwap_value + alpha * price * volume
+        self.vwap_volume = (1 - alpha) * self.vwap_volume + alpha * volume
+        self.last_price = price
+        self.count += 1
+
+    @property
+    def vwap(self) -> Optional[float]:
+        return self.vwap_value / self.vwap_volume if self.vwap_volume else None
+
+    @property
+    def volatility(self) -> float:
+        # standard deviation of the price change from trade to trade
+        return math.sqrt(self.variance)
+
+
+class Features:
+    # Per tick cache shared by the strategies. The best prices, the trade
+    # statistics and the bounded history are updated on every tick, book
+    # features are built on first use and dropped on the next tick.
+    def __init__(self, alpha: float = 0.1, capacity: int = 1000, trade_capacity: int = 1000) -> None:
+        self.alpha = alpha
+        self.capacity = capacity
+        self.trade_capacity = trade_capacity
+        self.state: Optional[TradingState] = None
+        self.books: Dict[Symbol, BookFeatures] = {}
+        # best bid and ask of every symbol of the tick
+        self.best: Dict[Symbol, tuple[Optional[int], Optional[int]]] = {}
+        self.ratios: Dict[tuple[Symbol, Symbol], tuple[float, float]] = {}
+        self.trades: Dict[Symbol, TradeStats] = {}
+        self.history: Dict[Symbol, SymbolHistory] = {}
+
+    def symbol_history(self, symbol: Symbol) -> SymbolHistory:
+        history = self.history.get(symbol)
+        if history is None:
+            history = self.history[symbol] = SymbolHistory(
+                self.capacity, self.trade_capacity)
+        return history
+
+    def update(self, state: TradingState) -> None:
+        # the best prices and the mid and traded volume of the tick go into
+        # the history and every trade into its stats, nothing else is
+        # worked out before a strategy asks for it
+        self.state = state
+        self.books = {}
+        self.ratios = {}
+        best = self.best = {}
+        histories = self.history
+        market_trades = state.market_trades
+        for symbol, depth in state.order_depths.items():
+            history = histories.get(symbol)
+            if history is None:
+                history = self.symbol_history(symbol)
+            buy_orders, sell_orders = depth.buy_orders, depth.sell_orders
+            bid = max(buy_orders) if buy_orders else None
+            ask = min(sell_orders) if sell_orders else None
+            best[symbol] = (bid, ask)
+            history.mids.append((bid + ask) / 2 if bid is not None and ask is not None else math.nan)
+            trades = market_trades.get(symbol)
+            if not trades:
+                history.volumes.append(0)
+                continue
+            stats = self.trades.get(symbol)
+            if stats is None:
+                stats = self.trades[symbol] = TradeStats(self.alpha)
+            volume = 0
+            for trade in trades:
+                stats.add(trade.price, trade.quantity)
+                history.trade_prices.append(trade.price)
+                history.trade_quantities.append(trade.quantity)
+                volume += abs(trade.quantity)
+            history.volumes.append(volume)
+
+    def book(self, symbol: Symbol) -> Optional[BookFeatures]:
+        features = self.books.get(symbol)
+        if features is None:
+            depth = self.state.order_depths.get(symbol)
+            if depth is None:
+                return None
+            features = self.books[symbol] = BookFeatures(depth, *self.best[symbol])
+        return features
+
+    def pair_ratios(self, numerator: Symbol, denominator: Symbol) -> Optional[tuple[float, float]]:
+        # numerator / denominator at the prices a pair trade crosses at,
+        # selling the numerator and buying the denominator, and the other way round
+        key = (numerator, denominator)
+        ratios = self.ratios.get(key)
+        if ratios is None:
+            top, bottom = self.book(numerator), self.book(denominator)
+            if top is None or bottom is None or top.mid is None or bottom.mid is None:
+                return None
+            ratios = self.ratios[key] = (top.best_bid / bottom.best_ask, top.best_ask / bottom.best_bid)
+        return ratios
+
+
+class Trader:
+
+    def __init__(self,
+                 pearls_fair_value: float = 10000,
+                 berries_buy_ends_at: int = 300 * 1000,
+                 berries_sell_starts_at: int = 500 * 1000,
+                 pair_upper_ratio: float = 1.876,
+                 pair_lower_ratio: float = 1.874,
+                 log_file=None) -> None:
+        # with a log_file the logs go there in batches instead of to stdout
+        self.logger = Logger(local=log_file is None, file=log_file)
+        self.pearls_fair_value = pearls_fair_value
+        # production, for backtesting 30 * 1000 and 50 * 1000
+        self.berries_buy_ends_at = berries_buy_ends_at
+        self.berries_sell_starts_at = berries_sell_starts_at
+        # PINA_COLADAS / COCONUTS price ratio band of the pair trade
+        self.pair_upper_ratio = pair_upper_ratio
+        self.pair_lower_ratio = pair_lower_ratio
+        self.features = Features()
 
     def run(self, state: TradingState) -> Dict[str, List[Order]]:
 
+        self.features.update(state)
         result = {}
         result["PEARLS"] = self.trade_pearls(state)
         result["BERRIES"] = self.trade_berries(state)
@@ -53,79 +413,58 @@ class Trader:
     def trade_pearls(self, state: TradingState) -> List[Order]:
         product = "PEARLS"
         limit = 20
-        fair_value = 10000
-        order_depth, position = state.order_depths.get(
-            product, None), state.position.get(product, 0)
-        if not order_depth:
+        fair_value = self.pearls_fair_value
+        book, position = self.features.book(product), state.position.get(product, 0)
+        if not book:
             return []
         orders = []
 
-        if order_depth.sell_orders and position < limit:
-            asks = sorted(order_depth.sell_orders.keys())
-            for ask in asks:
+        # the sorted sides are only needed when the best price crosses
+        if book.best_ask is not None and book.best_ask < fair_value and position < limit:
+            for ask in book.asks:
                 if ask < fair_value:
-                    volume = order_depth.sell_orders[ask]
+                    volume = book.depth.sell_orders[ask]
                     orders.append(Order(product, ask, -volume))
-        if order_depth.buy_orders and position > -limit:
-            bids = sorted(order_depth.buy_orders.keys(), reverse=True)
-            for bid in bids:
+        if book.best_bid is not None and book.best_bid > fair_value and position > -limit:
+            for bid in book.bids:
                 if bid > fair_value:
-                    volume = order_depth.buy_orders[bid]
+                    volume = book.depth.buy_orders[bid]
                     orders.append(Order(product, bid, -volume))
         return orders
 
     def trade_berries(self, state: TradingState) -> List[Order]:
         product = "BERRIES"
         limit = 250
-        order_depth, position, timestamp = state.order_depths.get(
-            product, None), state.position.get(product, 0), state.timestamp
-        if not order_depth:
+        book, position, timestamp = self.features.book(
+            product), state.position.get(product, 0), state.timestamp
+        if not book:
             return []
 
-        # # backtesting
-        # buy_ends_at = 30 * 1000
-        # sell_starts_at = 50 * 1000
-
-        # production
-        buy_ends_at = 300 * 1000
-        sell_starts_at = 500 * 1000
-
-        if timestamp < buy_ends_at and order_depth.sell_orders and position < limit:
-            best_ask = min(order_depth.sell_orders.keys())
-            volume = order_depth.sell_orders[best_ask]
-            return [Order(product, best_ask, -volume)]
-        if timestamp > sell_starts_at and order_depth.buy_orders and position > -limit:
-            best_bid = max(order_depth.buy_orders.keys())
-            volume = order_depth.buy_orders[best_bid]
-            return [Order(product, best_bid, -volume)]
+        buy_ends_at = self.berries_buy_ends_at
+        sell_starts_at = self.berries_sell_starts_at
+
+        if timestamp < buy_ends_at and book.best_ask is not None and position < limit:
+            return [Order(product, book.best_ask, -book.best_ask_volume)]
+        if timestamp > sell_starts_at and book.best_bid is not None and position > -limit:
+            return [Order(product, book.best_bid, -book.best_bid_volume)]
         return []
     
     def trade_coconut_pinacoladas(self, state: TradingState, product: str) -> List[Order]:
         orders = []
 
-        # Get the related product
-        related_product = "COCONUTS" if product == "PINA_COLADAS" else "PINA_COLADAS"
-
-        # get the order depth and position of the products
-        c_order_depth: OrderDepth = state.order_depths["COCONUTS"]
-        pc_order_depth: OrderDepth = state.order_depths["PINA_COLADAS"]
-        
-        # Get the best ask and bid prices and volumes for coconut
-        c_best_ask = min(c_order_depth.sell_orders.keys())
-        c_best_ask_volume = c_order_depth.sell_orders[c_best_ask]
-        c_best_bid = max(c_order_depth.buy_orders.keys())
-        c_best_bid_volume = c_order_depth.buy_orders[c_best_bid]
-        # Get the best ask and bid prices and volumes for pina colada
-        pc_best_ask = min(pc_order_depth.sell_orders.keys())
-        pc_best_ask_volume = pc_order_depth.sell_orders[pc_best_ask]
-        pc_best_bid = max(pc_order_depth.buy_orders.keys())
-        pc_best_bid_volume = pc_order_depth.buy_orders[pc_best_bid]
-
-        if pc_best_bid / c_best_ask > 1.876:
-            orders.append(Order(product, c_best_ask, -c_best_ask_volume)) if product == "COCONUTS" \
-                else orders.append(Order(product, pc_best_bid, -pc_best_bid_volume))
-        elif pc_best_ask / c_best_bid < 1.874:
-            orders.append(Order(product, c_best_bid, -c_best_bid_volume)) if product == "COCONUTS" \
-                else orders.append(Order(product, pc_best_ask, -pc_best_ask_volume))
+        # the best prices and ratios are shared by both calls of a tick
+        ratios = self.features.pair_ratios("PINA_COLADAS", "COCONUTS")
+        if ratios is None:
+            return orders
+        c_book = self.features.book("COCONUTS")
+        pc_book = self.features.book("PINA_COLADAS")
+        bid_ratio, ask_ratio = ratios
+
+        if bid_ratio > self.pair_upper_ratio:
+            orders.append(Order(product, c_book.best_ask, -c_book.best_ask_volume)) if product == "COCONUTS" \
+                else orders.append(Order(product, pc_book.best_bid, -pc_book.best_bid_volume))
+        elif ask_ratio < self.pair_lower_ratio:
+            orders.append(Order(product, c_book.best_bid, -c_book.best_bid_volume)) if product == "COCONUTS" \
+                else orders.append(Order(product, pc_book.best_ask, -pc_book.best_ask_volume))
 
         return orders
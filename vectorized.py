@@ -0,0 +1,250 @@
+from trader import Trader
+
+from datamodel import *
+from accounting import Accounting
+from bt import current_limits, liquidate_leftovers, load_market, simulate_markets
+from matching import PriceLadder, BUY, SELL
+from marketdata import MarketData
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+import os
+
+# Orders of one symbol for every tick of a day: limit prices and
+# quantities, positive to buy, negative to sell and 0 for no order
+OrderArrays = tuple[np.ndarray, np.ndarray]
+
+
+class DayBook:
+    # Best bid and ask of every symbol over a whole day as (ticks,) arrays.
+    # Prices are nan and volumes 0 where a side is empty, ask volumes are
+    # positive. levels gives the full (ticks x levels) book of a symbol.
+    def __init__(self, market: MarketData):
+        self.market = market
+        self.timestamps = market.timestamps
+        self.symbols = market.symbols
+        self.best_bid: dict[Symbol, np.ndarray] = {}
+        self.best_bid_volume: dict[Symbol, np.ndarray] = {}
+        self.best_ask: dict[Symbol, np.ndarray] = {}
+        self.best_ask_volume: dict[Symbol, np.ndarray] = {}
+        for s, symbol in enumerate(market.symbols):
+            # the first level is the best one, it is empty when the side is
+            self.best_bid[symbol] = np.where(
+                market.bid_prices[:, s, 0] > 0, market.bid_prices[:, s, 0], np.nan)
+            self.best_bid_volume[symbol] = market.bid_volumes[:, s, 0]
+            self.best_ask[symbol] = np.where(
+                market.ask_prices[:, s, 0] > 0, market.ask_prices[:, s, 0], np.nan)
+            self.best_ask_volume[symbol] = market.ask_volumes[:, s, 0]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def levels(self, symbol: Symbol) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        s = self.symbols.index(symbol)
+        market = self.market
+        return market.bid_prices[:, s], market.bid_volumes[:, s], market.ask_prices[:, s], market.ask_volumes[:, s]
+
+
+class VectorizedTrader:
+    # The strategies of Trader written on whole days: orders returns the
+    # order arrays of every symbol it trades. It does not see its position,
+    # for the symbols in gated the simulation drops orders of a side whose
+    # limit is already reached, like Trader does before sending them.
+    gated = {"PEARLS", "BERRIES"}
+
+    def __init__(self,
+                 pearls_fair_value: float = 10000,
+                 berries_buy_ends_at: int = 300 * 1000,
+                 berries_sell_starts_at: int = 500 * 1000,
+                 pair_upper_ratio: float = 1.876,
+                 pair_lower_ratio: float = 1.874) -> None:
+        self.pearls_fair_value = pearls_fair_value
+        self.berries_buy_ends_at = berries_buy_ends_at
+        self.berries_sell_starts_at = berries_sell_starts_at
+        self.pair_upper_ratio = pair_upper_ratio
+        self.pair_lower_ratio = pair_lower_ratio
+
+    def orders(self, book: DayBook) -> dict[Symbol, OrderArrays]:
+        orders = {}
+        if "PEARLS" in book.symbols:
+            orders["PEARLS"] = self.trade_pearls(book)
+        if "BERRIES" in book.symbols:
+            orders["BERRIES"] = self.trade_berries(book)
+        if "COCONUTS" in book.symbols and "PINA_COLADAS" in book.symbols:
+            orders["COCONUTS"], orders["PINA_COLADAS"] = self.trade_coconut_pinacoladas(book)
+        return orders
+
+    def trade_pearls(self, book: DayBook) -> OrderArrays:
+        # every ask below and every bid above the fair value is taken,
+        # one order up to the furthest of them does the same
+        bid_prices, bid_volumes, ask_prices, ask_volumes = book.levels("PEARLS")
+        fair_value = self.pearls_fair_value
+        cheap = (ask_prices > 0) & (ask_prices < fair_value)
+        rich = bid_prices > fair_value
+        buy = np.where(cheap, ask_prices, 0).max(axis=1)
+        sell = np.where(rich, bid_prices, np.iinfo(np.int64).max).min(axis=1)
+        buy_quantity = np.where(cheap, ask_volumes, 0).sum(axis=1)
+        sell_quantity = np.where(rich, bid_volumes, 0).sum(axis=1)
+        prices = np.where(buy_quantity > 0, buy, np.where(sell_quantity > 0, sell, 0))
+        quantities = np.where(buy_quantity > 0, buy_quantity, -sell_quantity)
+        return prices, quantities
+
+    def trade_berries(self, book: DayBook) -> OrderArrays:
+        symbol = "BERRIES"
+        times = book.timestamps
+        has_ask = ~np.isnan(book.best_ask[symbol])
+        has_bid = ~np.isnan(book.best_bid[symbol])
+        buy = (times < self.berries_buy_ends_at) & has_ask
+        sell = ~buy & (times > self.berries_sell_starts_at) & has_bid
+        prices = np.where(buy, np.nan_to_num(book.best_ask[symbol]),
+                          np.where(sell, np.nan_to_num(book.best_bid[symbol]), 0)).astype(np.int64)
+        quantities = np.where(buy, book.best_ask_volume[symbol],
+                              np.where(sell, -book.best_bid_volume[symbol], 0))
+        return prices, quantities
+
+    def trade_coconut_pinacoladas(self, book: DayBook) -> tuple[OrderArrays, OrderArrays]:
+        c_ask, c_bid = book.best_ask["COCONUTS"], book.best_bid["COCONUTS"]
+        pc_ask, pc_bid = book.best_ask["PINA_COLADAS"], book.best_bid["PINA_COLADAS"]
+        quoted = ~(np.isnan(c_ask) | np.isnan(c_bid) | np.isnan(pc_ask) | np.isnan(pc_bid))
+        with np.errstate(invalid='ignore'):
+            # buy COCONUTS and sell PINA_COLADAS, or the other way round
+            up = quoted & (pc_bid / c_ask > self.pair_upper_ratio)
+            down = quoted & ~up & (pc_ask / c_bid < self.pair_lower_ratio)
+        c_prices = np.where(up, np.nan_to_num(c_ask), np.where(down, np.nan_to_num(c_bid), 0)).astype(np.int64)
+        c_quantities = np.where(up, book.best_ask_volume["COCONUTS"],
+                                np.where(down, -book.best_bid_volume["COCONUTS"], 0))
+        pc_prices = np.where(up, np.nan_to_num(pc_bid), np.where(down, np.nan_to_num(pc_ask), 0)).astype(np.int64)
+        pc_quantities = np.where(up, -book.best_bid_volume["PINA_COLADAS"],
+                                 np.where(down, book.best_ask_volume["PINA_COLADAS"], 0))
+        return (c_prices, c_quantities), (pc_prices, pc_quantities)
+
+
+def level_fills(book: DayBook, symbol: Symbol, prices: np.ndarray, quantities: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Fills of every order against the book of its tick, one column per
+    # book level: buys walk the asks up to their price, sells the bids down.
+    # Returns the signed fill volumes and the level prices.
+    bid_prices, bid_volumes, ask_prices, ask_volumes = book.levels(symbol)
+    buys = (quantities > 0)[:, None]
+    level_prices = np.where(buys, ask_prices, bid_prices)
+    level_volumes = np.where(buys, ask_volumes, bid_volumes)
+    reachable = (level_prices > 0) & np.where(
+        buys, level_prices <= prices[:, None], level_prices >= prices[:, None])
+    available = np.where(reachable & (quantities != 0)[:, None], level_volumes, 0)
+    before = np.cumsum(available, axis=1) - available
+    volumes = np.clip(np.abs(quantities)[:, None] - before, 0, available)
+    return np.where(buys, volumes, -volumes), level_prices
+
+
+def simulate_vectorized(market: MarketData, strategy, end_liquidation=True, liquidation='walk') -> Accounting:
+    # Book fills are worked out for the whole day at once. Only ticks with
+    # fills are then walked in order to apply the position limits the way
+    # the backtester does: an order of a gated symbol on a side whose limit
+    # is reached is not sent and a fill that would cross a limit kills the
+    # rest of the tick.
+    book = DayBook(market)
+    orders = strategy.orders(book)
+    symbols = list(orders)
+    gated = getattr(strategy, 'gated', set(symbols))
+    fills = {symbol: level_fills(book, symbol, *orders[symbol]) for symbol in symbols}
+    active = np.zeros(len(market), dtype=bool)
+    for volumes, _ in fills.values():
+        active |= (volumes != 0).any(axis=1)
+
+    changes = np.zeros((len(market), len(market.symbols)), dtype=np.int64)
+    cash = np.zeros((len(market), len(market.symbols)))
+    columns = [market.symbols.index(symbol) for symbol in symbols]
+    position = dict.fromkeys(symbols, 0)
+    last = len(market) - 1
+    # fills of the last tick, the end of day liquidation walks what they left
+    closing: dict[Symbol, list[tuple[int, int]]] = {symbol: [] for symbol in symbols}
+    for i in np.flatnonzero(active).tolist():
+        killed = False
+        for symbol, s in zip(symbols, columns):
+            volumes, prices = fills[symbol]
+            limit = current_limits[symbol]
+            side = np.sign(orders[symbol][1][i])
+            if side == 0 or symbol in gated and position[symbol] * side >= limit:
+                continue
+            for volume, price in zip(volumes[i].tolist(), prices[i].tolist()):
+                if volume == 0:
+                    continue
+                if abs(position[symbol] + volume) > limit:
+                    killed = True
+                    break
+                position[symbol] += volume
+                changes[i, s] += volume
+                cash[i, s] -= price * volume
+                if i == last:
+                    closing[symbol].append((price, volume))
+            if killed:
+                break
+
+    # the fills of a tick show in the books of the next one,
+    # the last tick books its own
+    books = Accounting(history=True)
+    books.start(market)
+    books.positions[1:] = np.cumsum(changes, axis=0)[:-1]
+    books.cash_rows[1:] = np.cumsum(cash, axis=0)[:-1]
+    books.position = {symbol: 0 for symbol in market.symbols} | {
+        symbol: int(changes[:, s].sum()) for s, symbol in enumerate(market.symbols)}
+    books.cash = {symbol: float(cash[:, s].sum()) for s, symbol in enumerate(market.symbols)}
+    if end_liquidation and len(market) > 0:
+        state = market.state(last)
+        ladders = {}
+        for symbol, last_fills in closing.items():
+            depth = state.order_depths.get(symbol)
+            if depth is None:
+                continue
+            asks, bids = PriceLadder(depth.sell_orders, BUY), PriceLadder(depth.buy_orders, SELL)
+            for price, volume in last_fills:
+                if volume > 0:
+                    asks.take(price, volume)
+                else:
+                    bids.take(price, -volume)
+            ladders[symbol] = (asks, bids)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            liquidate_leftovers(books, state, liquidation, ladders=ladders)
+    if len(market) > 0:
+        books.record(len(market) - 1)
+    books.finish()
+    return books
+
+
+def parity(round: int, day: int, trader=None, strategy=None, time_limit=999900) -> pd.DataFrame:
+    return market_parity(load_market(round, day, time_limit), day, trader, strategy)
+
+
+def market_parity(market: MarketData, day=0, trader=None, strategy=None) -> pd.DataFrame:
+    # Final PnL per symbol of Trader.run tick by tick and of the vectorized
+    # strategy on the same day, with the largest gap between their PnL
+    # curves and the number of ticks where the curves differ
+    trader = Trader() if trader is None else trader
+    strategy = VectorizedTrader() if strategy is None else strategy
+    tick_books = Accounting(history=True)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        simulate_markets([market], day, trader, write_log=False, accounting=tick_books)
+    vector_books = simulate_vectorized(market, strategy)
+    ticks, vectors = tick_books.frame(), vector_books.frame()
+    symbols = [symbol for symbol in market.symbols if symbol in ticks and symbol in vectors]
+    gaps = (ticks[symbols] - vectors[symbols]).abs()
+    return pd.DataFrame({
+        'trader': ticks[symbols].iloc[-1],
+        'vectorized': vectors[symbols].iloc[-1],
+        'max_gap': gaps.max(),
+        'ticks_differing': (gaps > 1e-6).sum(),
+    })
+
+
+# Checks the vectorized strategies against Trader on every training day
+# and on a synthetic day where the PEARLS book often crosses its fair value
+if __name__ == "__main__":
+    from batch import available_days
+    from synth import generate_market
+    for round, day in available_days():
+        print(f'round {round} day {day}')
+        print(parity(round, day).to_string())
+    print('synthetic day')
+    synthetic = market_parity(generate_market(ticks=5000, seed=1))
+    print(synthetic.to_string())
+    assert synthetic.loc['PEARLS', 'trader'] != 0
+    assert (synthetic['ticks_differing'] == 0).all()
@@ -0,0 +1,151 @@
+from trader import Trader
+
+from accounting import Accounting
+from bt import TRAINING_DATA_PREFIX, data_paths, load_market, simulate_markets
+from batch import available_days
+from marketdata import CACHE_DIR
+from sweep import grid, share_markets
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from typing import Any, Optional
+import pandas as pd
+import hashlib
+import json
+import os
+import sweep
+
+# Results of one config on one day, keyed by the data, the config, the
+# simulation settings and the code
+RESULTS_DIR = os.path.join(TRAINING_DATA_PREFIX, CACHE_DIR, 'results')
+# Sources whose changes change the results of a backtest
+CODE_FILES = ['trader.py', 'datamodel.py', 'bt.py',
+              'matching.py', 'accounting.py', 'marketdata.py']
+# Days: rounds and days in order, a fold trains on some and tests on one
+Day = tuple[int, int]
+Fold = tuple[list[Day], Day]
+
+file_hashes: dict[tuple[str, int, int], str] = {}
+
+
+def file_hash(path: str) -> str:
+    # content hash, remembered per path, modification time and size
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = file_hashes.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digest = file_hashes[key] = sha.hexdigest()
+    return digest
+
+
+def data_hash(round: int, day: int) -> str:
+    return hashlib.sha256(''.join(file_hash(path) for path in data_paths(round, day)).encode()).hexdigest()
+
+
+def code_hash() -> str:
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return hashlib.sha256(''.join(file_hash(os.path.join(directory, name)) for name in CODE_FILES).encode()).hexdigest()
+
+
+def result_path(data: str, config: dict[str, Any], code: str, settings: dict[str, Any]) -> str:
+    # settings are what the backtest is run with besides the config:
+    # the time limit, the liquidation mode and the fill model
+    params = json.dumps(config, sort_keys=True)
+    run = json.dumps(settings, sort_keys=True)
+    key = hashlib.sha256(f'{data}|{params}|{run}|{code}'.encode()).hexdigest()
+    return os.path.join(RESULTS_DIR, f'{key}.json')
+
+
+def read_result(path: str) -> Optional[dict[str, float]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_result(path: str, summary: dict[str, float]):
+    # written to a temporary name first so a half written file is never read
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(summary, f)
+    os.replace(path + '.tmp', path)
+
+
+def walk_forward(days: list[Day], train_days: Optional[int] = None, min_train=1) -> list[Fold]:
+    # every day is tested on the days before it, all of them or the
+    # latest train_days
+    folds = []
+    for i in range(min_train, len(days)):
+        start = 0 if train_days is None else max(0, i - train_days)
+        folds.append((days[start:i], days[i]))
+    return folds
+
+
+def leave_one_out(days: list[Day]) -> list[Fold]:
+    return [([other for other in days if other != day], day) for day in days]
+
+
+def evaluate_day(task: tuple[dict[str, Any], Day, str, str]) -> dict[str, float]:
+    config, (round, day), liquidation, fill_model = task
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        accounting = Accounting()
+        simulate_markets([sweep.shared_markets[(round, day)]], day, Trader(**config), write_log=False,
+                         accounting=accounting, liquidation=liquidation, fill_model=fill_model)
+    return accounting.summary()
+
+
+def run_walk_forward(configs: list[dict[str, Any]], folds: list[Fold], max_workers=None, time_limit=999900,
+                     liquidation='walk', fill_model='book') -> pd.DataFrame:
+    # Every config is backtested once per day that any fold needs, in
+    # parallel, and only where the results cache has nothing for the day's
+    # data, the config, the settings and the code. Each fold then picks the config
+    # with the highest PnL over its training days and reports it on the
+    # held out day.
+    days = sorted({day for train, test in folds for day in train + [test]})
+    code = code_hash()
+    settings = {'time_limit': time_limit,
+                'liquidation': liquidation, 'fill_model': fill_model}
+    paths = {(i, day): result_path(data_hash(*day), config, code, settings)
+             for day in days for i, config in enumerate(configs)}
+    results = {task: read_result(path) for task, path in paths.items()}
+    missing = [task for task, result in results.items() if result is None]
+    if missing:
+        needed = sorted({day for _, day in missing})
+        for round, day in needed:
+            load_market(round, day, time_limit)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=share_markets, initargs=(needed, time_limit)) as pool:
+            summaries = pool.map(
+                evaluate_day, [(configs[i], day, liquidation, fill_model) for i, day in missing])
+            for task, summary in zip(missing, summaries):
+                write_result(paths[task], summary)
+                results[task] = summary
+
+    rows = []
+    for n, (train, test) in enumerate(folds):
+        train_pnl = [sum(results[(i, day)]['pnl'] for day in train)
+                     for i in range(len(configs))]
+        best = max(range(len(configs)), key=train_pnl.__getitem__)
+        row = {'fold': n,
+               'train': ' '.join(f'{round}/{day}' for round, day in train),
+               'test': f'{test[0]}/{test[1]}'}
+        row.update(configs[best])
+        row['train_pnl'] = train_pnl[best]
+        row['test_pnl'] = results[(best, test)]['pnl']
+        row['test_max_drawdown'] = results[(best, test)]['max_drawdown']
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# Walks the pair trade ratio band forward over the training days
+if __name__ == "__main__":
+    configs = grid({
+        'pair_upper_ratio': [1.872, 1.874, 1.876, 1.878],
+        'pair_lower_ratio': [1.870, 1.872, 1.874, 1.876],
+    })
+    configs = [c for c in configs if c['pair_lower_ratio']
+               <= c['pair_upper_ratio']]
+    folds = walk_forward(available_days())
+    print(run_walk_forward(configs, folds).to_string(index=False))